@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the default and compact rendering of API objects
+
+Usage::
+
+    python benchmarks/api_style.py [--documents 10] [--desc 30] [--methods 10]
+
+Generates an autodoc-like corpus (``--desc`` classes of ``--methods`` methods
+in every section, 3,000 symbols with the defaults) and builds it with
+``confluence_api_style`` set to ``default`` and ``compact``. Confluence is not
+available here, so the cost of rendering the pages is approximated by the
+number of storage format elements and the time the local preview
+(sphinx_confluence.preview) takes to render them. Fails unless the compact
+pages are smaller.
+"""
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import corpus
+import run
+
+sys.path.insert(0, run.ROOT)
+
+from sphinx_confluence.preview import StorageRenderer, parse_body  # noqa: E402
+
+
+def render_metrics(outdir):
+    bodies = []
+    for dirpath, _, filenames in os.walk(outdir):
+        for filename in filenames:
+            if filename.endswith('.xhtml'):
+                with io.open(os.path.join(dirpath, filename), encoding='utf-8') as f:
+                    bodies.append(f.read())
+
+    elements = sum(len(list(parse_body(body).iter())) - 1 for body in bodies)
+    renderer = StorageRenderer({})
+    start = time.time()
+    for body in bodies:
+        renderer.render(body)
+    return {'elements': elements, 'render': round(time.time() - start, 3)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--documents', type=int, default=10)
+    parser.add_argument('--sections', type=int, default=1)
+    parser.add_argument('--desc', type=int, default=30)
+    parser.add_argument('--methods', type=int, default=10)
+    options = parser.parse_args(argv)
+
+    corpus_options = argparse.Namespace(
+        documents=options.documents, sections=options.sections, code_blocks=0, code_lines=0, large_code_lines=0,
+        admonitions=0, images=0, desc=options.desc, methods=options.methods, table_rows=0)
+    srcdir = tempfile.mkdtemp(prefix='bench-api-')
+    try:
+        corpus.generate(srcdir, corpus_options)
+        documents = options.documents + 1
+        results = [(style, run.build('confluence', srcdir, documents, ['-D', 'confluence_api_style=%s' % style],
+                                     render_metrics))
+                   for style in ('default', 'compact')]
+    finally:
+        shutil.rmtree(srcdir)
+
+    print('%-10s %10s %14s %14s %12s' % ('style', 'wall, s', 'page bytes', 'elements', 'render, s'))
+    for style, result in results:
+        print('%-10s %10.2f %14d %14d %12.3f' % (
+            style, result['wall'], result['page_bytes'], result['elements'], result['render']))
+    if results[1][1]['page_bytes'] >= results[0][1]['page_bytes']:
+        sys.exit('the compact API style does not reduce the page size')
+
+
+if __name__ == '__main__':
+    main()
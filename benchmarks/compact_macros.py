@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Compare output size of tests/example.rst with and without compact macros
+
+Usage::
+
+    python benchmarks/compact_macros.py
+
+Builds the example with the confluence builder twice, the second time with
+``confluence_compact_macros = True``, and fails unless the compact output is
+smaller.
+"""
+
+import os
+import sys
+
+import run
+
+SETTINGS = ['-C', '-D', 'master_doc=example', '-D', 'extensions=sphinx_confluence,sphinx.ext.todo']
+
+
+def main():
+    srcdir = os.path.join(run.ROOT, 'tests')
+    indented = run.build('confluence', srcdir, 1, SETTINGS)['bytes']
+    compact = run.build('confluence', srcdir, 1, SETTINGS + ['-D', 'confluence_compact_macros=1'])['bytes']
+
+    print('indented macros: %d bytes' % indented)
+    print('compact macros:  %d bytes (%+.1f%%)' % (compact, (float(compact) / indented - 1) * 100))
+    if compact >= indented:
+        sys.exit('compact macros do not reduce the output size')
+
+
+if __name__ == '__main__':
+    main()
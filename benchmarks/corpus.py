@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic RST corpus generator
+
+Usage::
+
+    python benchmarks/corpus.py OUTDIR [--documents N] [--sections M] [--code-blocks K] ...
+
+Every document gets M sections; every section holds K code blocks, an
+admonition, an image, inline Jira issue and user roles, an autodoc-like
+class with methods (``desc`` nodes) and, optionally, a table of
+``--table-rows`` rows. With ``--large-code-lines`` the first section of every
+document also gets a code block of that many lines, as a generated schema or
+log sample would be. ``index.rst`` links all documents with a toctree.
+"""
+
+import argparse
+import os
+import shutil
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMAGE = os.path.join(os.path.dirname(HERE), 'tests', 'image.png')
+
+LOREM = (
+    'Lorem ipsum dolor sit amet, consectetur adipiscing elit. Integer egestas commodo lorem. Vivamus urna odio, '
+    'vehicula et blandit ut, accumsan vitae ipsum. Fusce lobortis, ligula vitae hendrerit elementum, urna leo '
+    'ultrices risus, eget rhoncus nibh leo sit amet orci.'
+)
+
+ADMONITIONS = ('note', 'warning', 'tip', 'danger', 'important')
+
+
+def title(text, char):
+    return '%s\n%s\n\n' % (text, char * len(text))
+
+
+def code_block(number, lines):
+    body = ''.join('   def function_%d_%d(argument):\n       return argument * %d\n\n' % (number, i, i)
+                   for i in range(lines // 3 + 1))
+    return '.. code-block:: python\n   :caption: Example %d\n\n%s' % (number, body)
+
+
+def autodoc_class(doc, section, methods):
+    parts = ['.. py:class:: Class%d_%d(argument)\n\n   %s\n\n' % (doc, section, LOREM)]
+    for i in range(methods):
+        parts.append(
+            '   .. py:method:: method_%d(self, value, *args, **kwargs)\n\n'
+            '      Method %d description.\n\n'
+            '      :param value: value description\n'
+            '      :returns: result description\n\n' % (i, i))
+    return ''.join(parts)
+
+
+def table(rows, columns=4):
+    parts = ['.. list-table::\n   :header-rows: 1\n\n']
+    for row in range(rows + 1):
+        for column in range(columns):
+            cell = 'Column %d' % column if row == 0 else 'cell %d.%d' % (row, column)
+            parts.append('   %s %s\n' % ('*' if column == 0 else ' ', '- ' + cell))
+    return ''.join(parts) + '\n'
+
+
+def document(number, options):
+    parts = [title('Document %d' % number, '=')]
+    for section in range(options.sections):
+        parts.append('.. _label-%d-%d:\n\n' % (number, section))
+        parts.append(title('Section %d.%d' % (number, section), '-'))
+        parts.append('%s :jira_issue:`PROJ-%d` %s :jira_user:`user%d`.\n\n' % (LOREM, section, LOREM, section))
+        for block in range(options.code_blocks):
+            parts.append(code_block(block, options.code_lines))
+        if options.large_code_lines and section == 0:
+            parts.append(code_block(options.code_blocks, options.large_code_lines))
+        if options.admonitions:
+            parts.append('.. %s:: %s\n\n' % (ADMONITIONS[section % len(ADMONITIONS)], LOREM))
+        if options.images:
+            parts.append('.. image:: /image.png\n   :width: 200px\n\n')
+        for _ in range(options.desc):
+            parts.append(autodoc_class(number, section, options.methods))
+        if options.table_rows:
+            parts.append(table(options.table_rows))
+        parts.append('See :ref:`label-%d-%d`.\n\n' % ((number + 1) % options.documents, section))
+    return ''.join(parts)
+
+
+def generate(outdir, options):
+    """
+    Write corpus into outdir, return master document name
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    shutil.copy(IMAGE, os.path.join(outdir, 'image.png'))
+
+    with open(os.path.join(outdir, 'conf.py'), 'w') as f:
+        f.write("extensions = ['sphinx_confluence']\nmaster_doc = 'index'\n")
+
+    toctree = ''.join('   doc%d\n' % number for number in range(options.documents))
+    with open(os.path.join(outdir, 'index.rst'), 'w') as f:
+        f.write(title('Index', '=') + '.. toctree::\n\n' + toctree)
+
+    for number in range(options.documents):
+        with open(os.path.join(outdir, 'doc%d.rst' % number), 'w') as f:
+            f.write(document(number, options))
+
+    return 'index'
+
+
+def add_arguments(parser):
+    parser.add_argument('--documents', type=int, default=100, help='number of documents (default: 100)')
+    parser.add_argument('--sections', type=int, default=5, help='sections per document (default: 5)')
+    parser.add_argument('--code-blocks', type=int, default=2, help='code blocks per section (default: 2)')
+    parser.add_argument('--code-lines', type=int, default=10, help='lines per code block (default: 10)')
+    parser.add_argument('--large-code-lines', type=int, default=0,
+                        help='lines of an extra code block per document (default: 0, no block)')
+    parser.add_argument('--admonitions', type=int, default=1, help='admonition per section, 0 or 1 (default: 1)')
+    parser.add_argument('--images', type=int, default=1, help='image per section, 0 or 1 (default: 1)')
+    parser.add_argument('--desc', type=int, default=1, help='autodoc-like classes per section (default: 1)')
+    parser.add_argument('--methods', type=int, default=5, help='methods per class (default: 5)')
+    parser.add_argument('--table-rows', type=int, default=20, help='rows of the table per section (default: 20)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('outdir')
+    add_arguments(parser)
+    options = parser.parse_args(argv)
+    generate(options.outdir, options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the import time of the extension
+
+Usage::
+
+    python benchmarks/import_time.py [--budget-ms 15] [--repeat 5]
+
+Sphinx is started first (with the html builder, so its own modules are
+loaded), then ``sphinx_confluence`` is imported under ``python -X importtime``
+in a fresh process. The fastest of the runs is compared with the budget; the
+script also fails if the extension imports modules that must stay lazy.
+Needs Python 3.7+.
+"""
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+IMPORT_SCRIPT = '''
+import sys
+from sphinx.application import Sphinx
+srcdir = sys.argv[1]
+Sphinx(srcdir, srcdir, srcdir + '/out', srcdir + '/doctrees', 'html', status=None, warning=None)
+sys.stderr.write('-- sphinx_confluence --\\n')
+import sphinx_confluence
+'''
+
+# modules only needed by rarely used features, they are imported on demand
+LAZY_MODULES = (
+    'distutils',
+    'multiprocessing.pool',
+    'PIL',
+    'sphinxcontrib.serializinghtml',
+    'http.server',
+    'mmap',
+    'sphinx_confluence.bundle',
+    'sphinx_confluence.json_conf',
+    'sphinx_confluence.preview',
+    'sphinx_confluence.profile',
+    'sphinx_confluence.publisher',
+    'sphinx_confluence.stubserver',
+    'sphinx_confluence.targets',
+    'sphinx_confluence.validate',
+    'sphinx_confluence.watch',
+)
+
+LINE_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def measure(srcdir):
+    """
+    Import the extension, return its cumulative import time (microseconds) and modules imported with it
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])),
+               PYTHONPYCACHEPREFIX=os.path.join(srcdir, 'pycache'))
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', IMPORT_SCRIPT, srcdir], env=env, stderr=subprocess.STDOUT)
+
+    lines = output.decode('utf-8').split('-- sphinx_confluence --', 1)[1].splitlines()
+    cumulative = None
+    modules = []
+    for line in lines:
+        match = LINE_RE.match(line)
+        if match is None:
+            continue
+        modules.append(match.group(4))
+        if match.group(4) == 'sphinx_confluence' and not match.group(3).strip(' '):
+            cumulative = int(match.group(2))
+    return cumulative, modules
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=15.0, help='allowed import time (default: 15)')
+    parser.add_argument('--repeat', type=int, default=5, help='imports to run, the fastest is kept (default: 5)')
+    options = parser.parse_args(argv)
+
+    if sys.version_info < (3, 7):
+        print('-X importtime needs Python 3.7+, skipped')
+        return
+
+    srcdir = tempfile.mkdtemp(prefix='bench-import-')
+    try:
+        open(os.path.join(srcdir, 'conf.py'), 'w').close()
+        # the first run compiles the modules
+        runs = [measure(srcdir) for _ in range(options.repeat + 1)][1:]
+    finally:
+        shutil.rmtree(srcdir)
+
+    elapsed = min(cumulative for cumulative, _ in runs) / 1000.0
+    modules = runs[0][1]
+    print('sphinx_confluence import: %.1f ms (budget %.1f ms)' % (elapsed, options.budget_ms))
+    print('imported with it: %s' % ', '.join(sorted(modules)))
+
+    eager = sorted(module for module in modules if module.startswith(LAZY_MODULES))
+    if eager:
+        sys.exit('modules that must be imported lazily: %s' % ', '.join(eager))
+    if elapsed > options.budget_ms:
+        sys.exit('import time is over the budget')
+
+
+if __name__ == '__main__':
+    main()
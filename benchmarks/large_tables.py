@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the confluence build of large tables inline and offloaded to CSV
+
+Usage::
+
+    python benchmarks/large_tables.py [--documents 10] [--table-rows 5000]
+
+Generates a corpus with a table of ``--table-rows`` rows in every section and
+builds it twice: with every table inline (``confluence_table_row_limit = 0``)
+and with the default limits, which attach large tables as CSV and keep their
+first rows on the page. Fails unless the pages get smaller.
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+
+import corpus
+import run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--documents', type=int, default=10)
+    parser.add_argument('--sections', type=int, default=2)
+    parser.add_argument('--table-rows', type=int, default=5000)
+    options = parser.parse_args(argv)
+
+    corpus_options = argparse.Namespace(
+        documents=options.documents, sections=options.sections, code_blocks=0, code_lines=0, large_code_lines=0,
+        admonitions=0, images=0, desc=0, methods=0, table_rows=options.table_rows)
+    srcdir = tempfile.mkdtemp(prefix='bench-tables-')
+    try:
+        corpus.generate(srcdir, corpus_options)
+        documents = options.documents + 1
+        inline = run.build('confluence', srcdir, documents, ['-D', 'confluence_table_row_limit=0'])
+        offloaded = run.build('confluence', srcdir, documents)
+    finally:
+        shutil.rmtree(srcdir)
+
+    print('%-10s %10s %14s %14s %14s' % ('tables', 'wall, s', 'peak RSS, KB', 'page bytes', 'bytes'))
+    for name, result in (('inline', inline), ('offloaded', offloaded)):
+        print('%-10s %10.2f %14d %14d %14d' % (
+            name, result['wall'], result['peak_rss_kb'], result['page_bytes'], result['bytes']))
+    if offloaded['page_bytes'] >= inline['page_bytes']:
+        sys.exit('offloading large tables does not reduce the page size')
+
+
+if __name__ == '__main__':
+    main()
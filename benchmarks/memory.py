@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Check that memory of the confluence build does not grow with the documents written
+
+Usage::
+
+    python benchmarks/memory.py [--documents 20] [--budget-kb 100]
+
+Builds a generated corpus of ``--documents`` documents and one four times as
+large, each in a fresh process, and fails when doctrees of translated
+documents are still alive after the build (page titles must be kept as plain
+strings, see sphinx_confluence.registry) or when peak RSS grows by more than
+``--budget-kb`` per document.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import corpus
+import run
+
+MEASURE_SCRIPT = '''
+import gc, resource, sys
+from docutils import nodes
+from sphinx.application import Sphinx
+srcdir, outdir = sys.argv[1:3]
+app = Sphinx(srcdir, srcdir, outdir, outdir + '/.doctrees', 'confluence', status=None, warning=None)
+app.build()
+gc.collect()
+documents = sum(1 for obj in gc.get_objects() if isinstance(obj, nodes.document))
+sys.stdout.write('%d %d\\n' % (documents, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+'''
+
+
+def measure(documents):
+    """
+    Build a corpus of the documents, return (doctrees alive after the build, peak RSS in KB)
+    """
+    options = argparse.Namespace(
+        documents=documents, sections=3, code_blocks=1, code_lines=5, large_code_lines=0, admonitions=1, images=0,
+        desc=0, methods=0, table_rows=0)
+    tmpdir = tempfile.mkdtemp(prefix='bench-memory-')
+    try:
+        srcdir = os.path.join(tmpdir, 'src')
+        corpus.generate(srcdir, options)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [run.ROOT, os.environ.get('PYTHONPATH')])))
+        output = subprocess.check_output(
+            [sys.executable, '-c', MEASURE_SCRIPT, srcdir, os.path.join(tmpdir, 'out')], env=env)
+    finally:
+        shutil.rmtree(tmpdir)
+    alive, rss = output.split()[-2:]
+    return int(alive), int(rss)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--documents', type=int, default=20)
+    parser.add_argument('--budget-kb', type=float, default=100.0,
+                        help='allowed peak RSS growth per document (default: 100)')
+    options = parser.parse_args(argv)
+
+    small = measure(options.documents)
+    large = measure(options.documents * 4)
+    growth = float(large[1] - small[1]) / (options.documents * 3)
+
+    print('%10s %16s %14s' % ('documents', 'doctrees alive', 'peak RSS, KB'))
+    for documents, (alive, rss) in ((options.documents, small), (options.documents * 4, large)):
+        print('%10d %16d %14d' % (documents, alive, rss))
+    print('peak RSS growth: %.1f KB per document (budget %.1f KB)' % (growth, options.budget_kb))
+
+    if large[0] > small[0]:
+        sys.exit('doctrees of written documents are kept alive')
+    if growth > options.budget_kb:
+        sys.exit('peak RSS grows over the budget')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Check that parallel confluence builds write the same output as serial ones
+
+Usage::
+
+    python benchmarks/parallel.py [--documents 20] [--jobs 4]
+
+Builds a generated corpus with the confluence builder twice, with ``-j 1``
+and ``-j --jobs``, and fails unless both output trees hold the same files
+with the same bytes. With at least ``--jobs`` CPUs it also fails unless the
+parallel build is faster than the serial one by ``min_speedup`` of
+``_parallel`` in benchmarks/baselines.json; reading is most of the build and
+runs in parallel, but Sphinx resolves the doctrees for the writers in the
+main process.
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+import corpus
+import run
+
+
+def tree_digests(outdir):
+    digests = {}
+    for dirpath, _, filenames in os.walk(outdir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path, 'rb') as f:
+                digests[os.path.relpath(path, outdir)] = hashlib.sha256(f.read()).hexdigest()
+    return {'files': digests}
+
+
+def load_min_speedup():
+    with open(run.BASELINES) as f:
+        return json.load(f).get('_parallel', {}).get('min_speedup')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--documents', type=int, default=20)
+    parser.add_argument('--jobs', type=int, default=4)
+    options = parser.parse_args(argv)
+
+    corpus_options = argparse.Namespace(
+        documents=options.documents, sections=3, code_blocks=1, code_lines=10, large_code_lines=0, admonitions=1,
+        images=1, desc=1, methods=3, table_rows=5)
+    srcdir = tempfile.mkdtemp(prefix='bench-parallel-')
+    try:
+        corpus.generate(srcdir, corpus_options)
+        documents = options.documents + 1
+        serial = run.build('confluence', srcdir, documents, ['-j', '1'], tree_digests)
+        parallel = run.build('confluence', srcdir, documents, ['-j', str(options.jobs)], tree_digests)
+    finally:
+        shutil.rmtree(srcdir)
+
+    speedup = serial['wall'] / parallel['wall']
+    print('-j 1: %d files, %.2f s' % (len(serial['files']), serial['wall']))
+    print('-j %d: %d files, %.2f s, %.2fx' % (options.jobs, len(parallel['files']), parallel['wall'], speedup))
+    names = sorted(set(serial['files']) | set(parallel['files']))
+    different = [name for name in names if serial['files'].get(name) != parallel['files'].get(name)]
+    if different:
+        sys.exit('output of -j 1 and -j %d differs: %s' % (options.jobs, ', '.join(different)))
+
+    min_speedup = load_min_speedup()
+    cpus = multiprocessing.cpu_count()
+    if min_speedup is None or cpus < options.jobs:
+        print('speedup not checked: %d CPUs for -j %d' % (cpus, options.jobs))
+    elif speedup < min_speedup:
+        sys.exit('-j %d is %.2fx as fast as -j 1, expected at least %.2fx' % (options.jobs, speedup, min_speedup))
+
+
+if __name__ == '__main__':
+    main()
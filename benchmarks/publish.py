@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Publish a small build to the stub Confluence twice, then rename a page
+
+Usage::
+
+    python benchmarks/publish.py [--documents 10] [--fail-every 4]
+
+Builds a generated corpus with the confluence builder and publishes it to
+sphinx_confluence.stubserver, which fails every ``--fail-every``-th request
+after carrying it out, as a server timing out after saving would. Fails
+unless the first publish creates every page exactly once and the second
+one uploads nothing. The title of one page is then changed in the manifest
+and published again, which must rename that page rather than create another.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+import corpus
+import run
+
+sys.path.insert(0, run.ROOT)
+
+from sphinx_confluence.publisher import ConfluenceClient, Publisher  # noqa: E402
+from sphinx_confluence.stubserver import StubConfluence, StubServer  # noqa: E402
+
+
+def rename_page(outdir):
+    """
+    Change the title of the last page in the manifest, return the page and its new title
+    """
+    filename = os.path.join(outdir, 'confluence-manifest.json')
+    with open(filename) as f:
+        manifest = json.load(f)
+    page = manifest['order'][-1]
+    title = manifest['pages'][page]['title'] = manifest['pages'][page]['title'] + ' (renamed)'
+    with open(filename, 'w') as f:
+        json.dump(manifest, f)
+    return page, title
+
+
+def publish_twice(outdir, fail_every):
+    store = StubConfluence(fail_every, fail_after_commit=True)
+    server = StubServer(('127.0.0.1', 0), store)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        client = ConfluenceClient('http://%s:%s' % server.server_address, retries=8, backoff=0.01)
+        pages = len(Publisher(client, 'DOC', outdir, workers=4).load_pages())
+        first = Publisher(client, 'DOC', outdir, workers=4).publish()
+        second = Publisher(client, 'DOC', outdir, workers=4).publish()
+        stored = len(store.pages)
+        renamed_page, renamed_title = rename_page(outdir)
+        renamed = Publisher(client, 'DOC', outdir, workers=4).publish()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    titles = [page['title'] for page in store.pages.values()]
+    return {
+        'pages': pages,
+        'first': first,
+        'second': second,
+        'stored': stored,
+        'renamed': renamed,
+        'renamed_page': renamed_page,
+        'after_rename': len(titles),
+        'renamed_title_stored': renamed_title in titles,
+        'duplicates': sorted(set(title for title in titles if titles.count(title) > 1)),
+        'failures': store.stats['failures'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--documents', type=int, default=10)
+    parser.add_argument('--fail-every', type=int, default=4, help='fail every N-th request (default: 4)')
+    options = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    corpus_options = argparse.Namespace(
+        documents=options.documents, sections=2, code_blocks=1, code_lines=5, large_code_lines=0, admonitions=1,
+        images=1, desc=0, methods=0, table_rows=0)
+    srcdir = tempfile.mkdtemp(prefix='bench-publish-')
+    try:
+        corpus.generate(srcdir, corpus_options)
+        result = run.build('confluence', srcdir, options.documents + 1, (),
+                           lambda outdir: publish_twice(outdir, options.fail_every))
+    finally:
+        shutil.rmtree(srcdir)
+
+    print('%d pages, first publish: %d uploaded, second publish: %d uploaded, %d injected failures' % (
+        result['pages'], result['first'], result['second'], result['failures']))
+    if result['duplicates']:
+        sys.exit('pages created twice: %s' % ', '.join(result['duplicates']))
+    if result['stored'] != result['pages'] or result['first'] != result['pages']:
+        sys.exit('first publish stored %d pages, expected %d' % (result['stored'], result['pages']))
+    if result['second']:
+        sys.exit('second publish uploaded %d unchanged pages' % result['second'])
+    if result['renamed'] != 1 or result['after_rename'] != result['pages'] or not result['renamed_title_stored']:
+        sys.exit('renaming %s uploaded %d pages and left %d pages stored, expected 1 and %d' % (
+            result['renamed_page'], result['renamed'], result['after_rename'], result['pages']))
+
+
+if __name__ == '__main__':
+    main()
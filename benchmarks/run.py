@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the extension on a generated corpus
+
+Usage::
+
+    python benchmarks/run.py [--builders html,json,confluence] [corpus options]
+    python benchmarks/run.py --check     # compare with benchmarks/baselines.json
+    python benchmarks/run.py --update    # store results as the new baselines
+
+Every build runs from scratch in a separate sphinx-build process. For each
+builder it records wall time, time per document, peak RSS of the build
+process and bytes written into the output directory (doctrees excluded), of
+which ``page_bytes`` are pages of the confluence builder.
+Corpus options are those of benchmarks/corpus.py; baselines are stored per
+corpus options, so only results of the same corpus are compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import corpus
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+BASELINES = os.path.join(HERE, 'baselines.json')
+
+# runs sphinx-build in-process and reports its peak RSS (kilobytes on Linux)
+BUILD_SCRIPT = '''
+import resource, sys
+try:
+    from sphinx.cmd.build import main
+except ImportError:
+    from sphinx import main
+    sys.argv.insert(1, sys.argv[0])
+status = main(sys.argv[1:])
+sys.stdout.write('%d\\n' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+sys.exit(status)
+'''
+
+CORPUS_OPTIONS = frozenset([
+    'documents', 'sections', 'code_blocks', 'code_lines', 'large_code_lines', 'admonitions', 'images', 'desc',
+    'methods', 'table_rows',
+])
+
+# metrics compared against baselines; time depends on the machine, so it gets a wider tolerance
+CHECKED = (('wall', 'time_tolerance'), ('peak_rss_kb', 'tolerance'), ('bytes', 'tolerance'))
+
+
+def tree_size(path, suffix=''):
+    return sum(
+        os.path.getsize(os.path.join(dirpath, filename))
+        for dirpath, _, filenames in os.walk(path)
+        for filename in filenames if filename.endswith(suffix)
+    )
+
+
+def build(builder, srcdir, documents, extra_args=(), inspect=None):
+    """
+    Build the corpus, return its metrics
+
+    :param inspect: called with the output directory before it is removed, returns more metrics
+    """
+    tmpdir = tempfile.mkdtemp(prefix='bench-%s-' % builder)
+    outdir = os.path.join(tmpdir, 'out')
+    command = [
+        sys.executable, '-c', BUILD_SCRIPT, '-q', '-b', builder,
+        '-d', os.path.join(tmpdir, 'doctrees'),
+    ] + list(extra_args) + [srcdir, outdir]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            start = time.time()
+            output = subprocess.check_output(command, env=env, stderr=devnull)
+            wall = time.time() - start
+        result = {
+            'wall': round(wall, 3),
+            'per_document': round(wall / documents, 5),
+            'peak_rss_kb': int(output.split()[-1]),
+            'bytes': tree_size(outdir),
+            'page_bytes': tree_size(outdir, '.xhtml'),
+        }
+        if inspect is not None:
+            result.update(inspect(outdir))
+        return result
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def corpus_key(options):
+    return ','.join('%s=%s' % (name, getattr(options, name)) for name in sorted(vars(options))
+                    if name in CORPUS_OPTIONS)
+
+
+def compare(results, baselines, options):
+    """
+    Print comparison with baselines, return list of regressions
+    """
+    regressions = []
+    for builder, result in sorted(results.items()):
+        baseline = baselines.get(builder)
+        if baseline is None:
+            print('%-12s no baseline' % builder)
+            continue
+        for metric, tolerance_name in CHECKED:
+            tolerance = getattr(options, tolerance_name)
+            change = float(result[metric]) / baseline[metric] - 1 if baseline[metric] else 0.0
+            flag = ''
+            if change > tolerance:
+                flag = '  REGRESSION'
+                regressions.append((builder, metric, change))
+            print('%-12s %-12s %14s -> %-14s %+7.1f%%%s' % (
+                builder, metric, baseline[metric], result[metric], change * 100, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--builders', default='html,json,confluence')
+    parser.add_argument('--repeat', type=int, default=1, help='builds per builder, the fastest is kept')
+    parser.add_argument('--check', action='store_true', help='fail on regressions against the baselines')
+    parser.add_argument('--update', action='store_true', help='store results as baselines')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed relative growth of peak RSS and bytes (default: 0.1)')
+    parser.add_argument('--time-tolerance', type=float, default=0.3,
+                        help='allowed relative growth of wall time (default: 0.3)')
+    parser.add_argument('--sphinx-args', default='', help='extra sphinx-build arguments, e.g. "-j 4"')
+    corpus.add_arguments(parser)
+    options = parser.parse_args(argv)
+
+    srcdir = tempfile.mkdtemp(prefix='bench-corpus-')
+    try:
+        corpus.generate(srcdir, options)
+        results = {}
+        for builder in options.builders.split(','):
+            runs = [build(builder, srcdir, options.documents + 1, options.sphinx_args.split())
+                    for _ in range(options.repeat)]
+            results[builder] = min(runs, key=lambda run: run['wall'])
+    finally:
+        shutil.rmtree(srcdir)
+
+    print('%-12s %10s %14s %14s %14s' % ('builder', 'wall, s', 'per doc, ms', 'peak RSS, KB', 'bytes'))
+    for builder, result in sorted(results.items()):
+        print('%-12s %10.2f %14.1f %14d %14d' % (
+            builder, result['wall'], result['per_document'] * 1000, result['peak_rss_kb'], result['bytes']))
+
+    try:
+        with open(BASELINES) as f:
+            stored = json.load(f)
+    except IOError:
+        stored = {}
+    key = corpus_key(options) + (' ' + options.sphinx_args if options.sphinx_args else '')
+
+    if options.update:
+        entry = stored.setdefault(key, {})
+        entry.update(results)
+        stored['_environment'] = {
+            'python': platform.python_version(),
+            'sphinx': subprocess.check_output(
+                [sys.executable, '-c', 'import sphinx; print(sphinx.__version__)']).decode().strip(),
+            'machine': platform.machine(),
+        }
+        with open(BASELINES, 'w') as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if options.check:
+        print('')
+        regressions = compare(results, stored.get(key, {}), options)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Check that pages split off different documents get unique titles
+
+Usage::
+
+    python benchmarks/split_titles.py
+
+Builds two documents with the same section titles, one of them repeated
+within a document, with the confluence builder splitting every document at
+level 2, and fails unless every written page has a title of its own.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import corpus
+import run
+
+SECTIONS = ('Overview', 'Examples', 'Examples')
+
+
+def page_titles(outdir):
+    titles = {}
+    for filename in os.listdir(outdir):
+        if filename.endswith('.xhtml'):
+            page = filename[:-len('.xhtml')]
+            with open(os.path.join(outdir, page + '.json')) as f:
+                titles[page] = json.load(f)['title']
+    return {'titles': titles}
+
+
+def generate(srcdir):
+    os.makedirs(srcdir)
+    with open(os.path.join(srcdir, 'conf.py'), 'w') as f:
+        f.write("extensions = ['sphinx_confluence']\nmaster_doc = 'index'\n")
+    with open(os.path.join(srcdir, 'index.rst'), 'w') as f:
+        f.write(corpus.title('Index', '=') + '.. toctree::\n\n   a\n   b\n')
+    for name in ('a', 'b'):
+        with open(os.path.join(srcdir, '%s.rst' % name), 'w') as f:
+            f.write(corpus.title('Document %s' % name.upper(), '=') + ''.join(
+                corpus.title(section, '-') + corpus.LOREM + '\n\n' for section in SECTIONS))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp(prefix='bench-split-')
+    try:
+        srcdir = os.path.join(tmpdir, 'src')
+        generate(srcdir)
+        result = run.build('confluence', srcdir, 3,
+                           ['-D', 'confluence_split_level=2', '-D', 'confluence_split_budget=0'], page_titles)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    titles = result['titles']
+    for page in sorted(titles):
+        print('%-24s %s' % (page, titles[page]))
+    split = [page for page in titles if '--' in page]
+    if len(split) != 2 * len(SECTIONS):
+        sys.exit('expected %d split-off pages, got %d' % (2 * len(SECTIONS), len(split)))
+    values = list(titles.values())
+    duplicates = sorted(set(title for title in values if values.count(title) > 1))
+    if duplicates:
+        sys.exit('page titles used more than once: %s' % ', '.join(duplicates))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Measure memory of writing a large page with and without streamed output
+
+Usage::
+
+    python benchmarks/stream_memory.py [--sections 50] [--budget 1.0]
+
+Generates a single document of ``--sections`` sections and one four times as
+large, and writes each with the confluence builder in a fresh process, with
+``confluence_stream_output`` off and on. tracemalloc traces the writing of the
+document, from the resolved doctree to the written page. Streamed output
+must keep the peak below half the buffered peak, and grow it by less than
+``--budget`` bytes per byte of page; what remains is the HTML writer
+annotating doctree nodes. Needs Python 3.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import corpus
+import run
+
+MEASURE_SCRIPT = '''
+import os, sys, tracemalloc
+from sphinx.application import Sphinx
+srcdir, outdir, stream = sys.argv[1:4]
+app = Sphinx(srcdir, srcdir, outdir, outdir + '/.doctrees', 'confluence', status=None, warning=None,
+             confoverrides={'confluence_stream_output': stream})
+peaks = {}
+write_doc = app.builder.write_doc
+
+def traced_write_doc(docname, doctree):
+    tracemalloc.start()
+    write_doc(docname, doctree)
+    peaks[docname] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+app.builder.write_doc = traced_write_doc
+app.build()
+sys.stdout.write('%d %d\\n' % (peaks['doc0'], os.path.getsize(os.path.join(outdir, 'doc0.xhtml'))))
+'''
+
+
+def measure(sections, stream):
+    """
+    Write a document of the sections, return (peak traced memory, page bytes)
+    """
+    options = argparse.Namespace(
+        documents=1, sections=sections, code_blocks=1, code_lines=10, large_code_lines=0, admonitions=1, images=0,
+        desc=1, methods=3, table_rows=5)
+    tmpdir = tempfile.mkdtemp(prefix='bench-stream-')
+    try:
+        srcdir = os.path.join(tmpdir, 'src')
+        corpus.generate(srcdir, options)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [run.ROOT, os.environ.get('PYTHONPATH')])))
+        output = subprocess.check_output(
+            [sys.executable, '-c', MEASURE_SCRIPT, srcdir, os.path.join(tmpdir, 'out'), '1' if stream else '0'],
+            env=env)
+    finally:
+        shutil.rmtree(tmpdir)
+    peak, size = output.split()[-2:]
+    return int(peak), int(size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sections', type=int, default=50)
+    parser.add_argument('--budget', type=float, default=1.0,
+                        help='allowed growth of the streamed peak per byte of page (default: 1.0)')
+    options = parser.parse_args(argv)
+
+    if sys.version_info < (3,):
+        print('tracemalloc needs Python 3, skipped')
+        return
+
+    results = {}
+    print('%10s %10s %14s %14s' % ('sections', 'output', 'page bytes', 'peak bytes'))
+    for sections in (options.sections, options.sections * 4):
+        for stream in (False, True):
+            results[sections, stream] = peak, size = measure(sections, stream)
+            print('%10d %10s %14d %14d' % (sections, 'streamed' if stream else 'buffered', size, peak))
+
+    small, large = results[options.sections, True], results[options.sections * 4, True]
+    growth = float(large[0] - small[0]) / (large[1] - small[1])
+    print('streamed peak growth: %.2f bytes per page byte (budget %.2f)' % (growth, options.budget))
+    if large[0] * 2 > results[options.sections * 4, False][0]:
+        sys.exit('streamed output does not halve the peak memory')
+    if growth > options.budget:
+        sys.exit('streamed peak memory grows with the page over the budget')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Compare separate confluence builds per target with one build writing all targets
+
+Usage::
+
+    python benchmarks/targets.py [--documents 30] [--targets 3]
+
+Generates a corpus and builds it for ``--targets`` targets differing by their
+Jira server: once per target, each build reading the sources, then once with
+``confluence_targets``, reading them once and writing the targets in parallel.
+Fails unless the single build is faster.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import corpus
+import run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--documents', type=int, default=30)
+    parser.add_argument('--sections', type=int, default=5)
+    parser.add_argument('--targets', type=int, default=3)
+    options = parser.parse_args(argv)
+
+    corpus_options = argparse.Namespace(
+        documents=options.documents, sections=options.sections, code_blocks=2, code_lines=20, large_code_lines=0,
+        admonitions=1, images=0, desc=0, methods=0, table_rows=0)
+    targets = dict(('target-%d' % number, {'confluence_jira_server_id': 'server-%d' % number})
+                   for number in range(options.targets))
+    srcdir = tempfile.mkdtemp(prefix='bench-targets-')
+    try:
+        corpus.generate(srcdir, corpus_options)
+        documents = options.documents + 1
+        separate = [run.build('confluence', srcdir, documents, ['-D', 'confluence_jira_server_id=%s' % server])
+                    for server in sorted(overrides['confluence_jira_server_id'] for overrides in targets.values())]
+        with open(os.path.join(srcdir, 'conf.py'), 'a') as f:
+            f.write('\nconfluence_targets = %r\n' % targets)
+        fan_out = run.build('confluence', srcdir, documents)
+    finally:
+        shutil.rmtree(srcdir)
+
+    separate_wall = sum(result['wall'] for result in separate)
+    print('%-10s %10s %14s %14s' % ('builds', 'wall, s', 'peak RSS, KB', 'page bytes'))
+    print('%-10s %10.2f %14d %14d' % (
+        'separate', separate_wall, max(result['peak_rss_kb'] for result in separate),
+        sum(result['page_bytes'] for result in separate)))
+    print('%-10s %10.2f %14d %14d' % ('targets', fan_out['wall'], fan_out['peak_rss_kb'], fan_out['page_bytes']))
+    if fan_out['wall'] >= separate_wall:
+        sys.exit('writing targets from one build is not faster than separate builds')
+
+
+if __name__ == '__main__':
+    main()
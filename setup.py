@@ -15,6 +15,15 @@ setup(
     include_package_data=True,
     license='MIT',
     install_requires=open('requirements.txt').read(),
+    entry_points={
+        'console_scripts': [
+            'sphinx-confluence-publish = sphinx_confluence.publisher:main',
+            'sphinx-confluence-watch = sphinx_confluence.watch:main',
+        ],
+        'sphinx.builders': [
+            'json_conf = sphinx_confluence.json_conf',
+        ],
+    },
     classifiers=[
         'Development Status :: 4 - Beta',
         'Environment :: Console',
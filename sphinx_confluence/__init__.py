@@ -5,7 +5,9 @@ https://confluence.atlassian.com/display/DOC/Confluence+Storage+Format
 
 """
 
-from distutils.version import LooseVersion
+__version__ = '0.0.4'
+
+import hashlib
 import os
 
 from docutils import nodes
@@ -13,15 +15,48 @@ from docutils.parsers.rst import directives, Directive, roles
 from docutils.parsers.rst.directives import images
 from docutils.parsers.rst.roles import set_classes
 
-import sphinx
-try:
-    from sphinx.builders.html import JSONHTMLBuilder
-except ImportError:
-    from sphinxcontrib.serializinghtml import JSONHTMLBuilder
+from sphinx import addnodes
 from sphinx.directives.code import CodeBlock
+from sphinx.directives.other import TocTree as SphinxTocTree
 from sphinx.locale import _
 from sphinx.writers.html import HTMLTranslator
 
+from sphinx_confluence import jira, macros
+from sphinx_confluence.attachments import update_attachment_index
+from sphinx_confluence.builder import ConfluenceBuilder
+from sphinx_confluence.dependencies import get_referring_docs, note_read_docs, process_page_references
+from sphinx_confluence.hierarchy import process_page_toctrees, update_page_hierarchy
+from sphinx_confluence.imaging import process_image_widths
+from sphinx_confluence.manifest import write_manifest
+from sphinx_confluence.references import clear_uri_docnames, resolve_anchor, resolve_uri
+from sphinx_confluence.registry import (
+    get_attachment_index, get_page_attachments, get_page_titles, merge_env_registries, purge_env_registries,
+)
+from sphinx_confluence.shared import get_shared_index, process_shared_includes, resolve_shared_includes, \
+    update_shared_index
+from sphinx_confluence.split import get_page_splits, get_page_title, process_page_split
+from sphinx_confluence.util import SPHINX_VERSION, warning
+
+#: Renderings of API objects (desc nodes), see HTMLConfluenceTranslator.visit_desc
+API_STYLES = ('default', 'compact')
+
+#: Confluence macro of the admonitions, ``confluence_admonition_map`` overrides it
+ADMONITION_MAP = {
+    'note': 'info',
+    'warning': 'note',
+    'attention': 'note',
+    'hint': 'tip',
+    'tip': 'tip',
+    'important': 'warning',
+    'error': 'warning',
+    'danger': 'warning',
+}
+
+#: Languages of the Code Block Macro, ``confluence_code_languages`` replaces them
+CODE_LANGUAGES = ['actionscript3', 'bash', 'csharp', 'coldfusion', 'cpp', 'css', 'delphi', 'diff', 'erlang',
+                  'groovy', 'html/xml', 'java', 'javafx', 'javascript', 'none', 'perl', 'php', 'powershell',
+                  'python', 'ruby', 'scala', 'sql', 'vb']
+
 
 def true_false(argument):
     return directives.choice(argument, ('true', 'false'))
@@ -31,44 +66,219 @@ def static_dynamic(argument):
     return directives.choice(argument, ('static', 'dynamic'))
 
 
-class TitlesCache(object):
-    titles = {}
-
-    @staticmethod
-    def _document_key(document):
-        return hash(document)
-
-    @classmethod
-    def set_title(cls, document, title):
-        cls.titles[cls._document_key(document)] = title
+class HTMLConfluenceTranslator(HTMLTranslator):
+    def __init__(self, *args, **kwargs):
+        HTMLTranslator.__init__(self, *args, **kwargs)
+        self.page_title_skipped = False
+        # file-like object the body is flushed to, see flush_body
+        self.stream = None
+        # attachments made from the document content, filename to sha256, see offload_literal_block
+        self.generated_attachments = {}
+        # page being translated: the document or a page split off it, see sphinx_confluence.split
+        self.current_page = self.builder.current_docname
+        self.split_plan = None
+        self.split_sections = {}
+        self.split_stack = []
+        # tables being translated: None or the rows kept inline, see offload_table
+        self.table_excerpts = []
+        self.split_pages = hasattr(self.builder, 'write_split_page')
+        if self.split_pages:
+            self.split_plan = get_page_splits(self.builder.env).get(self.builder.current_docname)
+        if self.split_plan is not None:
+            self.split_sections = dict((page['id'], page) for page in self.split_plan['pages'])
+        # Jira mode of the document and issues referenced on the page, see visit_jira_issue
+        self.jira_mode = jira.get_jira_mode(self.builder.app, self.builder.current_docname)
+        self.jira_keys = []
+        # API style of the document and depth of API objects translated in the compact style, see visit_desc
+        self.api_style = get_api_style(self.builder.app, self.builder.current_docname)
+        self.compact_descs = 0
+        self.profile = None
+        if self.builder.config.confluence_profile:
+            from sphinx_confluence.profile import TranslatorProfile
+            self.profile = TranslatorProfile(self)
+            self.profile.install()
+
+    def flush_body(self):
+        """
+        Write translated fragments to the output stream and drop them from memory
 
-    @classmethod
-    def get_title(cls, document):
-        return cls.titles.get(cls._document_key(document), None)
+        Called as sections are departed, when the builder streams output.
+        """
+        if self.stream is not None and self.body:
+            self.stream.write(u''.join(self.body))
+            del self.body[:]
 
-    @classmethod
-    def has_title(cls, document):
-        return cls._document_key(document) in cls.titles
+    def confluence_config(self, name):
+        """
+        Value of the ``confluence_<name>`` config option
+        """
+        return getattr(self.builder.config, 'confluence_' + name)
 
+    def macro(self, macro, **values):
+        """
+        Render macro template, see sphinx_confluence.macros
+        """
+        return macros.render(macro, self.confluence_config('compact_macros'), **values)
 
-class JSONConfluenceBuilder(JSONHTMLBuilder):
-    """For backward compatibility"""
+    @property
+    def page_title(self):
+        """ Title of the page being translated, as taken by Confluence """
+        return get_page_title(self.builder.env, self.current_page)
 
-    name = 'json_conf'
+    def anchor_page(self, refid):
+        """
+        Page holding the anchor of the document and the anchor to link to on it (None for the page top)
+        """
+        return resolve_anchor(self.builder.env, self.builder.current_docname, refid, self.split_pages)
 
-    def __init__(self, app):
-        super(JSONConfluenceBuilder, self).__init__(app)
-        if LooseVersion(sphinx.__version__) >= LooseVersion("1.4"):
-            self.translator_class = HTMLConfluenceTranslator
-        self.warn('json_conf builder is deprecated and will be removed in future releases')
+    def start_split_page(self, page):
+        """
+        Translate following nodes into the body of the page split off the document
 
+        The page gets its own body, headings start from the top level again and
+        the title of its section is the page title.
+        """
+        self.split_stack.append((self.current_page, self.body, self.stream, self.section_level,
+                                 self.page_title_skipped, self.generated_attachments, self.jira_keys))
+        self.current_page = page['page']
+        self.body = []
+        self.stream = None
+        self.section_level = 0
+        self.page_title_skipped = False
+        self.generated_attachments = {}
+        self.jira_keys = []
+
+    def finish_split_page(self):
+        self.append_jira_batch()
+        self.builder.write_split_page(self.current_page, ''.join(self.body), self.generated_attachments)
+        (self.current_page, self.body, self.stream, self.section_level,
+         self.page_title_skipped, self.generated_attachments, self.jira_keys) = self.split_stack.pop()
+
+    def depart_document(self, node):
+        self.append_jira_batch()
+        HTMLTranslator.depart_document(self, node)
+        if self.profile is not None:
+            self.profile.dump(self.builder.outdir, self.builder.current_docname)
 
-class HTMLConfluenceTranslator(HTMLTranslator):
     def unimplemented_visit(self, node):
-        self.builder.warn('Unimplemented visit is not implemented for node: {}'.format(node))
+        if self.profile is not None:
+            self.profile.note_unknown(node)
+        warning(self.builder.app, 'Unimplemented visit is not implemented for node: {}'.format(node))
 
     def unknown_visit(self, node):
-        self.builder.warn('Unknown visit is not implemented for node: {}'.format(node))
+        if self.profile is not None:
+            self.profile.note_unknown(node)
+        warning(self.builder.app, 'Unknown visit is not implemented for node: {}'.format(node))
+
+    def visit_shared_include(self, node):
+        """
+        Content included into several documents (see sphinx_confluence.shared)
+
+        Translated once, into the shared page, and shown on the pages with the
+        Include Page Macro:
+
+        <ac:structured-macro ac:name="include">
+          <ac:parameter ac:name="">
+            <ac:link><ri:page ri:content-title="common.txt (3f2a9c1b)" /></ac:link>
+          </ac:parameter>
+        </ac:structured-macro>
+        """
+        shared = None
+        if self.split_pages:
+            shared = get_shared_index(self.builder.env).get(node.get('fingerprint'))
+        if shared is not None and shared['owner'] != self.builder.current_docname:
+            self.body.append(self.macro('include', title=self.attval(shared['title'])))
+            raise nodes.SkipNode
+
+        self.context.append(shared)
+        if shared is not None:
+            section_level = self.section_level
+            self.start_split_page(shared)
+            # headings of the fragment keep their levels, the page has its own title
+            self.section_level = section_level
+            self.page_title_skipped = True
+
+    def depart_shared_include(self, node):
+        shared = self.context.pop()
+        if shared is not None:
+            self.finish_split_page()
+            self.body.append(self.macro('include', title=self.attval(shared['title'])))
+
+    def visit_jira_issue(self, node):
+        """
+        Jira issue, rendered according to the Jira mode of the page (see sphinx_confluence.jira)
+
+        inline:
+
+        <ac:structured-macro ac:name="jira" ac:schema-version="1">
+          <ac:parameter ac:name="key">WDT-117</ac:parameter>
+          <ac:parameter ac:name="showSummary">false</ac:parameter>
+        </ac:structured-macro>
+
+        batch, a link to the Jira Issues macro at the end of the page:
+
+        <ac:link ac:anchor="jira-issues">
+          <ac:plain-text-link-body><![CDATA[WDT-117]]></ac:plain-text-link-body>
+        </ac:link>
+
+        static: <a href="https://jira.example.com/browse/WDT-117">WDT-117</a> - Summary (Status)
+        """
+        key = node.astext()
+        if self.jira_mode == 'batch':
+            if key not in self.jira_keys:
+                self.jira_keys.append(key)
+            self.body.append(self.macro('jira_issue_link', anchor=jira.BATCH_ANCHOR, body=macros.cdata(key)))
+        elif self.jira_mode == 'static':
+            self.body.append(self.static_jira_issue(key))
+        else:
+            self.body.append(self.macro('jira_issue', key=self.encode(key)))
+        raise nodes.SkipNode
+
+    def visit_jira_issues(self, node):
+        """
+        Jira Issues macro of the jira_issues directive, see JiraIssuesDirective
+        """
+        self.body.append(jira.render_jira_issues(node, self.builder.config))
+        raise nodes.SkipNode
+
+    def static_jira_issue(self, key):
+        filename = jira.get_snapshot_filename(self.builder.config, self.builder.confdir)
+        issue = jira.load_snapshot(self.builder.app, filename).get(key) if filename is not None else None
+        if issue is None:
+            warning(self.builder.app, '%s: Jira issue %s is not in the snapshot' % (self.current_page, key))
+            return self.encode(key)
+
+        parts = [self.encode(key)]
+        if issue['url']:
+            parts = ['<a href="%s">%s</a>' % (self.attval(issue['url']), parts[0])]
+        if issue['summary']:
+            parts.append(' - %s' % self.encode(issue['summary']))
+        if issue['status']:
+            parts.append(' (%s)' % self.encode(issue['status']))
+        return ''.join(parts)
+
+    def append_jira_batch(self):
+        """
+        Jira Issues macro of the issues referenced on the page in batch mode
+
+        <ac:structured-macro ac:name="anchor">
+          <ac:parameter ac:name="">jira-issues</ac:parameter>
+        </ac:structured-macro>
+        <ac:structured-macro ac:name="jira" ac:schema-version="1">
+          <ac:parameter ac:name="columns">key,summary,status</ac:parameter>
+          <ac:parameter ac:name="maximumIssues">2</ac:parameter>
+          <ac:parameter ac:name="jqlQuery">key in (WDT-117, WDT-118)</ac:parameter>
+        </ac:structured-macro>
+        """
+        if not self.jira_keys:
+            return
+        parameters = [
+            ('columns', 'key,summary,status'),
+            ('maximumIssues', len(self.jira_keys)),
+            ('jqlQuery', 'key in (%s)' % ', '.join(self.jira_keys)),
+        ]
+        self.body.append(self.macro('anchor', name=jira.BATCH_ANCHOR))
+        self.body.append(macros.jira_issues(parameters, self.confluence_config('compact_macros')))
 
     def visit_admonition(self, node, name=''):
         """
@@ -87,36 +297,43 @@ class HTMLConfluenceTranslator(HTMLTranslator):
         </ac:structured-macro>
         """
 
-        confluence_admonition_map = {
-            'note': 'info',
-            'warning': 'note',
-            'attention': 'note',
-            'hint': 'tip',
-            'tip': 'tip',
-            'important': 'warning',
-            'error': 'warning',
-            'danger': 'warning',
-        }
+        admonition_map = dict(ADMONITION_MAP, **(self.confluence_config('admonition_map') or {}))
+        admonition_type = admonition_map.get(name, 'info')
 
-        admonition_type = confluence_admonition_map.get(name, 'info')
+        self.body.append(self.macro('admonition_start', name=admonition_type))
 
-        macro = """\
-            <ac:structured-macro ac:name="{admonition_type}">
-              <ac:parameter ac:name="icon">true</ac:parameter>
-              <ac:parameter ac:name="title"></ac:parameter>
-              <ac:rich-text-body>
+    def depart_admonition(self, node=None):
+        self.body.append(self.macro('admonition_end'))
+
+    def get_attachment(self, node, default_filename):
         """
+        Attachment name of the file referenced by the node and title of the
+        page it is attached to (None for the current page)
 
-        self.body.append(macro.format(admonition_type=admonition_type))
+        See sphinx_confluence.attachments
+        """
+        env = self.builder.env
+        info = get_attachment_index(env).get(node.get('confluence_attachment'))
+        if info is None:
+            return default_filename, None
+        if info['page'] == self.current_page:
+            return info['filename'], None
+        return info['filename'], get_page_titles(env).get(info['page'])
+
+    def attachment_resource(self, filename, page_title=None):
+        """
+        Attachment resource identifier
 
-    def depart_admonition(self, node=None):
-        macro = """
-              </ac:rich-text-body>
-            </ac:structured-macro>\n
+        <ri:attachment ri:filename="atlassian_logo.gif">
+          <ri:page ri:content-title="Page Title" />
+        </ri:attachment>
         """
-        self.body.append(macro)
+        if page_title is None:
+            return '<ri:attachment ri:filename="%s" />' % self.attval(filename)
+        return '<ri:attachment ri:filename="%s"><ri:page ri:content-title="%s" /></ri:attachment>' % (
+            self.attval(filename), self.attval(page_title))
 
-    def imgtag(self, filename, suffix='\n', **attributes):
+    def imgtag(self, filename, suffix='\n', resource=None, **attributes):
         """
         Attached image
 
@@ -148,7 +365,7 @@ class HTMLConfluenceTranslator(HTMLTranslator):
         attlist = atts.items()
         attlist = sorted(attlist)
         parts = []
-        src_part = '<ri:attachment ri:filename="%s" />' % filename
+        src_part = resource or self.attachment_resource(filename)
         for name, value in attlist:
             # value=None was used for boolean attributes without
             # value, but this isn't supported by XHTML.
@@ -172,7 +389,7 @@ class HTMLConfluenceTranslator(HTMLTranslator):
     def visit_image(self, node):
         atts = {}
         uri = node['uri']
-        filename = os.path.basename(uri)
+        filename, page_title = self.get_attachment(node, os.path.basename(uri))
         atts['alt'] = node.get('alt', uri)
         atts['thumbnail'] = 'true'
 
@@ -191,17 +408,16 @@ class HTMLConfluenceTranslator(HTMLTranslator):
             suffix = '\n'
 
         self.context.append('')
-        self.body.append(self.imgtag(filename, suffix, **atts))
+        self.body.append(self.imgtag(filename, suffix, self.attachment_resource(filename, page_title), **atts))
 
     def visit_title(self, node):
-        if isinstance(node.parent, nodes.section) and not TitlesCache.has_title(self.document):
+        if isinstance(node.parent, nodes.section) and not self.page_title_skipped:
             h_level = self.section_level + self.initial_header_level - 1
             if h_level == 1:
                 # Confluence take first title for page title from rst
-                # It use for making internal links
-                TitlesCache.set_title(self.document, node.children[0])
-
-                # ignore first header; document must have title header
+                # (see process_page_title); ignore first header,
+                # document must have title header
+                self.page_title_skipped = True
                 raise nodes.SkipNode
 
         HTMLTranslator.visit_title(self, node)
@@ -217,15 +433,12 @@ class HTMLConfluenceTranslator(HTMLTranslator):
         </ac:structured-macro>
         """
 
-        # Anchor confluence macros
-        anchor_macros = """
-            <ac:structured-macro ac:name="anchor">
-              <ac:parameter ac:name="">%s</ac:parameter>
-            </ac:structured-macro>
-        """
-
         if 'refid' in node or 'refname' in node:
 
+            if 'refid' in node and 'refuri' not in node and self.anchor_page(node['refid'])[0] != self.current_page:
+                # anchor of the split-off page, see start_split_page
+                return
+
             if 'refuri' in node:
                 link = node['refuri']
             elif 'refid' in node:
@@ -233,7 +446,7 @@ class HTMLConfluenceTranslator(HTMLTranslator):
             else:
                 link = node['refname']
 
-            self.body.append(anchor_macros % link)
+            self.body.append(self.macro('anchor', name=link))
 
     def depart_target(self, node):
         pass
@@ -262,9 +475,7 @@ class HTMLConfluenceTranslator(HTMLTranslator):
             if node['language'] == 'collapse':
                 parts.append('<ac:parameter ac:name="collapse">true</ac:parameter>')
 
-            valid = ['actionscript3', 'bash', 'csharp', 'coldfusion', 'cpp', 'css', 'delphi', 'diff', 'erlang',
-                     'groovy', 'html/xml', 'java', 'javafx', 'javascript', 'none', 'perl', 'php', 'powershell',
-                     'python', 'ruby', 'scala', 'sql', 'vb']
+            valid = self.confluence_config('code_languages') or CODE_LANGUAGES
 
             if node['language'] not in valid:
                 node['language'] = 'none'
@@ -274,15 +485,49 @@ class HTMLConfluenceTranslator(HTMLTranslator):
         if 'linenos' in node and node['linenos']:
             parts.append('<ac:parameter ac:name="linenumbers">true</ac:parameter>')
 
+        source = node.rawsource
+        limit = self.confluence_config('literal_block_limit')
+        if limit and len(source.encode('utf-8')) > limit and hasattr(self.builder, 'write_generated_attachment'):
+            self.offload_literal_block(node, parts)
+            raise nodes.SkipNode
+
         if 'caption' in node and node['caption']:
-            parts.append('<ac:parameter ac:name="title">%s</ac:parameter>' % node['caption'])
+            parts.append('<ac:parameter ac:name="title">%s</ac:parameter>' % self.encode(node['caption']))
 
-        parts.append('<ac:plain-text-body><![CDATA[%s]]></ac:plain-text-body>' % node.rawsource)
+        parts.append('<ac:plain-text-body>%s</ac:plain-text-body>' % macros.cdata(source))
         parts.append('</ac:structured-macro>')
 
         self.body.append(''.join(parts))
         raise nodes.SkipNode
 
+    def offload_literal_block(self, node, parts):
+        """
+        Attach literal block too large for the page, show its first lines
+
+        The code macro holds a collapsed excerpt of
+        ``confluence_literal_block_excerpt`` lines and is followed by a link to
+        the attachment with the whole block.
+        """
+        data = node.rawsource.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        filename = 'literal-%s.txt' % digest[:8]
+        self.builder.write_generated_attachment(filename, data)
+        self.generated_attachments[filename] = digest
+
+        lines = node.rawsource.splitlines()
+        excerpt = lines[:self.confluence_config('literal_block_excerpt')]
+        title = node.get('caption') or filename
+        parts.append('<ac:parameter ac:name="title">%s (%d of %d lines)</ac:parameter>' % (
+            self.encode(title), len(excerpt), len(lines)))
+        if '<ac:parameter ac:name="collapse">true</ac:parameter>' not in parts:
+            parts.append('<ac:parameter ac:name="collapse">true</ac:parameter>')
+        parts.append('<ac:plain-text-body>%s</ac:plain-text-body>' % macros.cdata('\n'.join(excerpt)))
+        parts.append('</ac:structured-macro>')
+        parts.append('<p><ac:link>%s<ac:plain-text-link-body>%s</ac:plain-text-link-body></ac:link></p>' % (
+            self.attachment_resource(filename), macros.cdata('%s, %d lines' % (filename, len(lines)))))
+
+        self.body.append(''.join(parts))
+
     def visit_download_reference(self, node):
         """
         Link to an attachment
@@ -302,11 +547,12 @@ class HTMLConfluenceTranslator(HTMLTranslator):
         if len(node.children) > 0 and len(node.children[0].children) > 0:
             text = node.children[0].children[0]
 
+        filename, page_title = self.get_attachment(node, node['filename'])
         parts = [
             '<ac:link>',
-            '<ri:attachment ri:filename="%s" />' % node['filename'],
+            self.attachment_resource(filename, page_title),
             '<ac:plain-text-link-body>',
-            '<![CDATA[%s]]>' % text if text else '',
+            macros.cdata(text) if text else '',
             '</ac:plain-text-link-body>',
             '</ac:link>',
         ]
@@ -316,11 +562,16 @@ class HTMLConfluenceTranslator(HTMLTranslator):
 
     def visit_section(self, node):
         # removed section open tag
+        if node['ids'] and node['ids'][0] in self.split_sections:
+            self.start_split_page(self.split_sections[node['ids'][0]])
         self.section_level += 1
 
     def depart_section(self, node):
         # removed section close tag
         self.section_level -= 1
+        if node['ids'] and self.split_sections.get(node['ids'][0], {}).get('page') == self.current_page:
+            self.finish_split_page()
+        self.flush_body()
 
     def visit_reference(self, node):
         atts = {'class': 'reference'}
@@ -328,24 +579,31 @@ class HTMLConfluenceTranslator(HTMLTranslator):
             atts['class'] += ' internal'
         else:
             atts['class'] += ' external'
-        if 'refuri' in node:
-            atts['href'] = ''
-            # Confluence makes internal links with prefix from page title
-            if node.get('internal') and TitlesCache.has_title(self.document):
-                atts['href'] += '#%s-' % TitlesCache.get_title(self.document).replace(' ', '')
 
+        # page and anchor the internal reference points to, see sphinx_confluence.references
+        target = None
+        if 'refuri' not in node:
+            assert 'refid' in node, 'References must have "refuri" or "refid" attribute.'
+            target = self.anchor_page(node['refid'])
+        elif node.get('internal'):
+            target = resolve_uri(self.builder, self.builder.current_docname, node['refuri'], self.split_pages)
+
+        if target is not None and target[0] != self.current_page:
+            self.visit_page_link(*target)
+            return
+
+        atts['href'] = ''
+        # Confluence makes internal links with prefix from page title
+        if node.get('internal') and self.page_title:
+            atts['href'] += '#%s-' % self.page_title.replace(' ', '')
+
+        if target is not None:
+            atts['href'] += target[1] or ''
+        else:
             atts['href'] += node['refuri']
             if self.settings.cloak_email_addresses and atts['href'].startswith('mailto:'):
                 atts['href'] = self.cloak_mailto(atts['href'])
                 self.in_mailto = 1
-        else:
-            assert 'refid' in node, 'References must have "refuri" or "refid" attribute.'
-
-            atts['href'] = ''
-            # Confluence makes internal links with prefix from page title
-            if node.get('internal') and TitlesCache.has_title(self.document):
-                atts['href'] += '#%s-' % TitlesCache.get_title(self.document).replace(' ', '')
-            atts['href'] += node['refid']
 
         if not isinstance(node.parent, nodes.TextElement):
             assert len(node) == 1 and isinstance(node[0], nodes.image)
@@ -354,24 +612,91 @@ class HTMLConfluenceTranslator(HTMLTranslator):
             atts['title'] = node['reftitle']
 
         self.body.append(self.starttag(node, 'a', '', **atts))
+        self.context.append('</a>')
 
         if node.get('secnumber'):
             self.body.append(('%s' + self.secnumber_suffix) % '.'.join(map(str, node['secnumber'])))
 
+    def depart_reference(self, node):
+        self.body.append(self.context.pop())
+        if not isinstance(node.parent, nodes.TextElement):
+            self.body.append('\n')
+        self.in_mailto = False
+
+    def visit_page_link(self, page, anchor=None):
+        """
+        Link to another Confluence page
+
+        https://confluence.atlassian.com/display/DOC/Confluence+Storage+Format#ConfluenceStorageFormat-Links
+
+        <ac:link ac:anchor="anchor">
+          <ri:page ri:content-title="Page Title" />
+          <ac:link-body>Link text</ac:link-body>
+        </ac:link>
+        """
+        attributes = ' ac:anchor="%s"' % self.attval(anchor) if anchor else ''
+        self.body.append('<ac:link%s><ri:page ri:content-title="%s" /><ac:link-body>' % (
+            attributes, self.attval(get_page_title(self.builder.env, page) or page)))
+        self.context.append('</ac:link-body></ac:link>')
+
     def visit_desc(self, node):
         """ Replace <dl> """
+        if self.api_style == 'compact':
+            self.visit_compact_desc(node)
+            return
         self.body.append(self.starttag(node, 'div', style="margin-top: 10px"))
 
     def depart_desc(self, node):
+        if self.api_style == 'compact':
+            self.depart_compact_desc(node)
+            return
         self.body.append('</div>\n\n')
 
+    def visit_compact_desc(self, node):
+        """
+        API object in the compact style: signature paragraphs followed by the
+        content, members of an object grouped in an Expand Macro
+
+        <p>
+          <ac:structured-macro ac:name="anchor">
+            <ac:parameter ac:name="">module.Class</ac:parameter>
+          </ac:structured-macro>
+          <code>class module.Class(argument)</code>
+        </p>
+        <p>Class description.</p>
+        <ac:structured-macro ac:name="expand">
+          <ac:parameter ac:name="title">2 members</ac:parameter>
+          <ac:rich-text-body>
+            <p>...<code>method(self, value)</code></p>
+            <p><strong>Parameters:</strong> <strong>value</strong> - value description</p>
+            ...
+          </ac:rich-text-body>
+        </ac:structured-macro>
+        """
+        members = sibling_descs(node)
+        if members and node is members[0]:
+            title = '%d member%s' % (len(members), '' if len(members) == 1 else 's')
+            self.body.append(self.macro('expand_start', title=title))
+        self.compact_descs += 1
+
+    def depart_compact_desc(self, node):
+        self.compact_descs -= 1
+        members = sibling_descs(node)
+        if members and node is members[-1]:
+            self.body.append(self.macro('expand_end'))
+
     def visit_desc_signature(self, node):
         """ Replace <dt> """
+        if self.api_style == 'compact':
+            self.body.append('<p>')
+            self.body.extend(self.macro('anchor', name=anchor) for anchor in node['ids'])
+            self.body.append('<code>%s</code></p>\n' % self.encode(signature_text(node)))
+            raise nodes.SkipNode
         # the id is set automatically
         self.body.append(self.starttag(
             node, 'div', style='margin-left: 20px; font-weight: bold;'))
         # anchor for per-desc interactive data
-        if node.parent['objtype'] != 'describe' and node['ids'] and node['first']:
+        if node.parent['objtype'] != 'describe' and node['ids'] and node.get('first'):
             self.body.append('<!--[%s]-->' % node['ids'][0])
 
     def depart_desc_signature(self, node):
@@ -381,12 +706,63 @@ class HTMLConfluenceTranslator(HTMLTranslator):
 
     def visit_desc_content(self, node):
         """ Replace <dd> """
+        if self.api_style == 'compact':
+            return
         self.body.append(self.starttag(
             node, 'div', '', style='margin-left: 40px;'))
 
     def depart_desc_content(self, node):
+        if self.api_style == 'compact':
+            return
         self.body.append('</div>')
 
+    def visit_field_list(self, node):
+        if not self.compact_descs:
+            HTMLTranslator.visit_field_list(self, node)
+
+    def depart_field_list(self, node):
+        if not self.compact_descs:
+            HTMLTranslator.depart_field_list(self, node)
+
+    def visit_field(self, node):
+        if not self.compact_descs:
+            HTMLTranslator.visit_field(self, node)
+
+    def depart_field(self, node):
+        if not self.compact_descs:
+            HTMLTranslator.depart_field(self, node)
+
+    def visit_field_name(self, node):
+        """
+        Fields of API objects in the compact style are paragraphs, the body
+        of a single paragraph follows the name:
+
+        <p><strong>Returns:</strong> result description</p>
+        """
+        if not self.compact_descs:
+            HTMLTranslator.visit_field_name(self, node)
+            return
+        self.body.append('<p><strong>%s:</strong>' % self.encode(node.astext()))
+        body = node.next_node(nodes.field_body, descend=False, siblings=True)
+        if body is None or not single_paragraph(body):
+            self.body.append('</p>\n')
+        raise nodes.SkipNode
+
+    def visit_field_body(self, node):
+        if not self.compact_descs:
+            HTMLTranslator.visit_field_body(self, node)
+            return
+        if single_paragraph(node):
+            self.body.append(' ')
+            for child in node[0].children:
+                child.walkabout(self)
+            self.body.append('</p>\n')
+            raise nodes.SkipNode
+
+    def depart_field_body(self, node):
+        if not self.compact_descs:
+            HTMLTranslator.depart_field_body(self, node)
+
     def visit_table(self, node):
         """ Fix ugly table border
         """
@@ -396,6 +772,68 @@ class HTMLConfluenceTranslator(HTMLTranslator):
         self.body.append(
             self.starttag(node, 'table', CLASS=classes, border="0"))
 
+        excerpt = None
+        if hasattr(self.builder, 'open_generated_attachment'):
+            excerpt = self.offload_table(node)
+        self.table_excerpts.append(excerpt)
+
+    def depart_table(self, node):
+        HTMLTranslator.depart_table(self, node)
+        excerpt = self.table_excerpts.pop()
+        if excerpt is not None:
+            self.body.append('<p><ac:link>%s<ac:plain-text-link-body>%s</ac:plain-text-link-body></ac:link></p>\n' % (
+                self.attachment_resource(excerpt['filename']),
+                macros.cdata('%s, %d rows' % (excerpt['filename'], excerpt['total']))))
+
+    def offload_table(self, node):
+        """
+        Attach table too large for the page as CSV, keep its first rows
+
+        Tables with more than ``confluence_table_row_limit`` body rows or
+        ``confluence_table_size_limit`` bytes of text are written to a
+        ``table-<digest>.csv`` attachment row by row; only the header and the
+        first ``confluence_table_excerpt`` rows are rendered, followed by a
+        link to the attachment (see depart_table).
+
+        :return: None if the table is rendered as a whole, otherwise
+            {"tbody": <body>, "limit": <rows kept>, "rows": 0, "total": <rows>, "filename": <attachment>}
+        """
+        tgroups = [child for child in node.children if isinstance(child, nodes.tgroup)]
+        if len(tgroups) != 1:
+            return None
+        parts = [child for child in tgroups[0].children if isinstance(child, (nodes.thead, nodes.tbody))]
+        tbody = parts[-1] if parts and isinstance(parts[-1], nodes.tbody) else None
+        if tbody is None:
+            return None
+
+        row_limit = self.confluence_config('table_row_limit')
+        size_limit = self.confluence_config('table_size_limit')
+        too_long = row_limit and len(tbody.children) > int(row_limit)
+        if not too_long and not (size_limit and len(node.astext().encode('utf-8')) > int(size_limit)):
+            return None
+
+        with self.builder.open_generated_attachment('table', '.csv') as attachment:
+            for part in parts:
+                for row in part.children:
+                    attachment.write(csv_row(entry.astext() for entry in row.children).encode('utf-8'))
+        self.generated_attachments[attachment.filename] = attachment.digest
+
+        return {
+            'tbody': tbody,
+            'limit': int(self.confluence_config('table_excerpt')),
+            'rows': 0,
+            'total': len(tbody.children),
+            'filename': attachment.filename,
+        }
+
+    def visit_row(self, node):
+        excerpt = self.table_excerpts[-1] if self.table_excerpts else None
+        if excerpt is not None and node.parent is excerpt['tbody']:
+            excerpt['rows'] += 1
+            if excerpt['rows'] > excerpt['limit']:
+                raise nodes.SkipNode
+        HTMLTranslator.visit_row(self, node)
+
     def write_colspecs(self):
         """ Fix ugly column width
         """
@@ -420,7 +858,7 @@ class ImageConf(images.Image):
         return [image_node]
 
 
-class TocTree(Directive):
+class TocTree(SphinxTocTree):
     """
         Replace sphinx "toctree" directive to confluence macro
 
@@ -434,34 +872,31 @@ class TocTree(Directive):
           <ac:parameter ac:name="maxLevel">3</ac:parameter>
           <ac:parameter ac:name="type">list</ac:parameter>
         </ac:structured-macro>
+
+        The toctree node is kept hidden next to the macro, so Sphinx still
+        knows the document tree (see sphinx_confluence.hierarchy); it renders
+        nothing.
     """
-    has_content = True
-    required_arguments = 0
-    optional_arguments = 0
-    final_argument_whitespace = False
-    option_spec = {
-        'maxdepth': int,
-        'name': directives.unchanged,
-        'caption': directives.unchanged_required,
-        'glob': directives.flag,
-        'hidden': directives.flag,
-        'includehidden': directives.flag,
-        'titlesonly': directives.flag,
-    }
 
     def run(self):
-        macro = """
-            <ac:structured-macro ac:name="toc">
-              <ac:parameter ac:name="style">square</ac:parameter>
-              <ac:parameter ac:name="minLevel">1</ac:parameter>
-              <ac:parameter ac:name="maxLevel">3</ac:parameter>
-              <ac:parameter ac:name="type">list</ac:parameter>
-            </ac:structured-macro>\n
-        """
+        macro = macros.render('toc', compact_macros(self.state.document))
 
         attributes = {'format': 'html'}
         raw_node = nodes.raw('', macro, **attributes)
-        return [raw_node]
+
+        result = [raw_node]
+        for node in SphinxTocTree.run(self):
+            toctrees = list(node.traverse(addnodes.toctree))
+            if not toctrees:
+                # warnings about missing documents
+                result.append(node)
+                continue
+            for toctree in toctrees:
+                toctree['confluence_hidden'] = toctree['hidden']
+                toctree['hidden'] = True
+                toctree.parent = None
+                result.append(toctree)
+        return result
 
 
 class JiraIssuesDirective(Directive):
@@ -497,44 +932,23 @@ class JiraIssuesDirective(Directive):
     }
 
     def run(self):
-        result = ['<ac:structured-macro ac:name="jira" ac:schema-version="1">']
-        param_macro = '<ac:parameter ac:name="{name}">{value}</ac:parameter>'
-
-        for name, value in self.options.items():
-            result.append(param_macro.format(name=underscore_to_camelcase(name), value=value))
-
-        jql_query = self.arguments[0]
-        result.append(param_macro.format(name='jqlQuery', value=jql_query))
-
-        result.append('</ac:structured-macro>')
-        attributes = {'format': 'html'}
-
-        raw_node = nodes.raw('', '\n'.join(result), **attributes)
-        return [raw_node]
+        # rendered by the translator, see HTMLConfluenceTranslator.visit_jira_issues
+        parameters = [[underscore_to_camelcase(name), value] for name, value in sorted(self.options.items())]
+        return [jira.jira_issues(self.block_text, parameters=parameters, jql=self.arguments[0])]
 
 
 class JiraIssueRole(roles.GenericRole):
 
-    def __call__(self, role, rawtext, text, *args, **kwargs):
-        macro = """\
-          <ac:structured-macro ac:name="jira" ac:schema-version="1">
-            <ac:parameter ac:name="key">{key}</ac:parameter>
-            <ac:parameter ac:name="showSummary">false</ac:parameter>
-          </ac:structured-macro>
-        """
-        attributes = {'format': 'html'}
-        return [nodes.raw('', macro.format(key=text), **attributes)], []
+    def __call__(self, role, rawtext, text, lineno, inliner, *args, **kwargs):
+        # rendered by the translator, see HTMLConfluenceTranslator.visit_jira_issue
+        return [jira.jira_issue(rawtext, text)], []
 
 
 class JiraUserRole(roles.GenericRole):
-    def __call__(self, role, rawtext, text, *args, **kwargs):
-        macro = """\
-        <ac:link>
-            <ri:user ri:username="{username}"/>
-        </ac:link>
-        """
+    def __call__(self, role, rawtext, text, lineno, inliner, *args, **kwargs):
+        macro = macros.render('jira_user', compact_macros(inliner.document), username=text)
         attributes = {'format': 'html'}
-        return [nodes.raw('', macro.format(username=text), **attributes)], []
+        return [nodes.raw('', macro, **attributes)], []
 
 
 class CaptionedCodeBlock(CodeBlock):
@@ -550,6 +964,121 @@ class CaptionedCodeBlock(CodeBlock):
         return ret
 
 
+def process_page_title(app, doctree):
+    """
+    Register title of the first section as the Confluence page title
+
+    Confluence uses it as prefix of the in-page anchors, so internal links
+    are made from it.
+    """
+    env = app.builder.env
+    for section in doctree.traverse(nodes.section):
+        if len(section) and isinstance(section[0], nodes.title):
+            get_page_titles(env)[env.docname] = section[0].astext()
+        break
+
+
+def process_page_attachments(app, doctree):
+    """
+    Register files attached to the page: images and downloadable files
+    """
+    env = app.builder.env
+    attachments = set()
+
+    for node in doctree.traverse(nodes.image):
+        candidates = node.get('candidates', {'*': node['uri']})
+        for key in sorted(candidates, key=lambda key: key != '*'):
+            uri = candidates[key]
+            if '://' not in uri and os.path.isfile(os.path.join(env.srcdir, uri)):
+                node.setdefault('confluence_attachment', uri)
+                attachments.add(uri)
+
+    for node in doctree.traverse(addnodes.download_reference):
+        rel_filename = env.relfn2path(node['reftarget'], env.docname)[0]
+        if os.path.isfile(os.path.join(env.srcdir, rel_filename)):
+            node['confluence_attachment'] = rel_filename
+            attachments.add(rel_filename)
+
+    get_page_attachments(env)[env.docname] = sorted(attachments)
+
+
+def get_api_style(app, docname):
+    """
+    API style of the document: the ``:api_style:`` field of the document
+    metadata, or ``confluence_api_style``
+
+    :type app: sphinx.application.Sphinx
+    """
+    env = app.builder.env
+    style = env.metadata.get(docname, {}).get('api_style') or env.config.confluence_api_style
+    if style not in API_STYLES:
+        warning(app, '%s: unknown API style %r, use one of %s' % (docname, style, ', '.join(API_STYLES)))
+        return 'default'
+    return style
+
+
+def sibling_descs(node):
+    """
+    API objects among the members of the object holding the node, None at the top level
+    """
+    if not isinstance(node.parent, addnodes.desc_content):
+        return None
+    return [child for child in node.parent.children if isinstance(child, addnodes.desc)]
+
+
+def single_paragraph(node):
+    return len(node.children) == 1 and isinstance(node[0], nodes.paragraph)
+
+
+def signature_text(node):
+    """
+    Plain text of the signature, with the separators HTML writers add
+    """
+    if isinstance(node, nodes.Text):
+        return node.astext()
+    if isinstance(node, addnodes.desc_parameterlist):
+        return '(%s)' % ', '.join(signature_text(child) for child in node.children)
+    if isinstance(node, addnodes.desc_optional):
+        return '[%s]' % ', '.join(signature_text(child) for child in node.children)
+    text = ''.join(signature_text(child) for child in node.children)
+    if isinstance(node, addnodes.desc_returns):
+        return ' -> ' + text
+    return text
+
+
+def compact_macros(document):
+    """
+    Whether macros of the document are rendered without whitespace
+
+    Directives and roles render macros while the document is read, so the
+    option changes the doctrees.
+    """
+    env = getattr(document.settings, 'env', None)
+    return bool(env is not None and env.config.confluence_compact_macros)
+
+
+def write_profile_report(app, exception):
+    """
+    Write translator profile, see sphinx_confluence.profile
+    """
+    if app.config.confluence_profile:
+        from sphinx_confluence import profile
+        profile.write_profile_report(app, exception)
+
+
+def csv_row(cells):
+    """
+    CSV line of the cells, whitespace of every cell collapsed
+    """
+    values = []
+    for cell in cells:
+        value = ' '.join(cell.split())
+        if any(char in value for char in ',"'):
+            value = '"%s"' % value.replace('"', '""')
+        values.append(value)
+    return ','.join(values) + '\r\n'
+
+
 def underscore_to_camelcase(text):
     return ''.join(word.title() if i else word for i, word in enumerate(text.split('_')))
 
@@ -568,9 +1097,10 @@ def setup(app):
     app.config.html_theme_path = [get_path()]
     app.config.html_theme = 'confluence'
     app.config.html_scaled_image_link = False
-    if LooseVersion(sphinx.__version__) >= LooseVersion("1.4"):
+    if SPHINX_VERSION >= (1, 4):
         app.set_translator("html", HTMLConfluenceTranslator)
         app.set_translator("json", HTMLConfluenceTranslator)
+        app.set_translator("confluence", HTMLConfluenceTranslator)
     else:
         app.config.html_translator_class = 'sphinx_confluence.HTMLConfluenceTranslator'
     app.config.html_add_permalinks = ''
@@ -586,4 +1116,64 @@ def setup(app):
     app.add_directive('jira_issues', JiraIssuesDirective)
     app.add_directive('code-block', CaptionedCodeBlock)
 
-    app.add_builder(JSONConfluenceBuilder)
+    if SPHINX_VERSION < (1, 6):
+        # newer versions load it on demand through the sphinx.builders entry point
+        from sphinx_confluence.json_conf import JSONConfluenceBuilder
+        app.add_builder(JSONConfluenceBuilder)
+    app.add_builder(ConfluenceBuilder)
+
+    app.add_config_value('confluence_manifest', 'confluence-manifest.json', '')
+    app.add_config_value('confluence_stream_output', False, '')
+    app.add_config_value('confluence_bundle', None, '')
+    app.add_config_value('confluence_validate', False, '')
+    app.add_config_value('confluence_validate_fail_fast', False, '')
+    app.add_config_value('confluence_compact_macros', False, 'env')
+    app.add_config_value('confluence_admonition_map', None, '')
+    app.add_config_value('confluence_code_languages', None, '')
+    app.add_config_value('confluence_api_style', 'default', '')
+    app.add_config_value('confluence_literal_block_limit', 64 * 1024, '')
+    app.add_config_value('confluence_literal_block_excerpt', 30, '')
+    app.add_config_value('confluence_table_row_limit', 1000, '')
+    app.add_config_value('confluence_table_size_limit', None, '')
+    app.add_config_value('confluence_table_excerpt', 50, '')
+    app.add_config_value('confluence_shared_includes', False, 'env')
+    app.add_config_value('confluence_split_level', None, 'env')
+    app.add_config_value('confluence_split_budget', 512 * 1024, 'env')
+    app.add_config_value('confluence_split_macro_budget', None, 'env')
+    app.add_config_value('confluence_image_optimize', False, '')
+    app.add_config_value('confluence_image_max_width', None, '')
+    app.add_config_value('confluence_image_quality', 85, '')
+    app.add_config_value('confluence_jira_mode', 'inline', 'env')
+    app.add_config_value('confluence_jira_snapshot', None, 'env')
+    app.add_config_value('confluence_jira_server_id', None, '')
+    app.add_config_value('confluence_jira_baseurl', None, '')
+    app.add_config_value('confluence_targets', None, '')
+    app.add_config_value('confluence_profile', False, '')
+    app.add_config_value('confluence_profile_top', 15, '')
+
+    app.connect('doctree-read', process_page_title)
+    app.connect('doctree-read', process_page_attachments)
+    app.connect('doctree-read', process_image_widths)
+    app.connect('doctree-read', process_shared_includes)
+    app.connect('doctree-read', process_page_split)
+    app.connect('doctree-read', jira.process_jira_issues)
+    app.connect('doctree-read', process_page_references)
+    app.connect('doctree-read', process_page_toctrees)
+    app.connect('env-before-read-docs', note_read_docs)
+    app.connect('doctree-resolved', jira.resolve_jira_issues)
+    app.connect('doctree-resolved', resolve_shared_includes)
+    app.connect('env-purge-doc', purge_env_registries)
+    app.connect('env-merge-info', merge_env_registries)
+    app.connect('env-updated', update_attachment_index)
+    app.connect('env-updated', get_referring_docs)
+    app.connect('env-updated', update_page_hierarchy)
+    app.connect('env-updated', update_shared_index)
+    app.connect('env-updated', clear_uri_docnames)
+    app.connect('build-finished', write_manifest)
+    app.connect('build-finished', write_profile_report)
+
+    return {
+        'version': __version__,
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed page attachments
+
+Images and downloadable files are identified by the SHA-256 of their content.
+Every distinct file is attached once, to the first page (by docname) that
+uses it; other pages refer to it on that page. Attachments that share a
+basename but differ in content get the digest prefix appended to their name,
+so they never collide.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from sphinx_confluence.registry import get_attachment_index, get_page_attachments
+
+
+def file_digest(filename, chunk_size=1 << 16):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class GeneratedAttachment(object):
+    """
+    Attachment made from the page content, written as it is produced
+
+    It is named ``<prefix>-<digest><suffix>`` on close, as its digest is only
+    known then; ``filename`` and ``digest`` are set by close().
+    """
+
+    def __init__(self, directory, prefix, suffix):
+        self.directory = directory
+        self.prefix = prefix
+        self.suffix = suffix
+        self.filename = None
+        self.digest = None
+        self._digest = hashlib.sha256()
+        fd, self._path = tempfile.mkstemp(prefix='.%s-' % prefix, suffix=suffix, dir=directory)
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self._digest.update(data)
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+        self.digest = self._digest.hexdigest()
+        self.filename = '%s-%s%s' % (self.prefix, self.digest[:8], self.suffix)
+        path = os.path.join(self.directory, self.filename)
+        if os.path.exists(path):
+            # same name, same content
+            os.remove(self._path)
+        else:
+            os.rename(self._path, path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(self._path)
+
+
+def hash_files(filenames):
+    """
+    Map filenames to their digests; files are hashed in a thread pool
+    """
+    if len(filenames) < 2:
+        return dict((filename, file_digest(filename)) for filename in filenames)
+
+    # imported here as most builds have nothing to hash
+    from multiprocessing import cpu_count
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(min(len(filenames), cpu_count()))
+    try:
+        return dict(zip(filenames, pool.map(file_digest, filenames)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def update_attachment_index(app, env):
+    """
+    Rebuild the attachment index once all documents are read
+
+    Only files whose size or mtime changed since the previous build are
+    hashed again. Returns docnames whose attachments were renamed or moved to
+    another page, so they are written again.
+
+    :type app: sphinx.application.Sphinx
+    :type env: sphinx.environment.BuildEnvironment
+    """
+    previous = get_attachment_index(env)
+
+    users = {}
+    for docname, rel_filenames in get_page_attachments(env).items():
+        for rel_filename in rel_filenames:
+            users.setdefault(rel_filename, []).append(docname)
+
+    stats = {}
+    digests = {}
+    outdated = {}
+    for rel_filename in users:
+        filename = os.path.join(env.srcdir, rel_filename)
+        stat = os.stat(filename)
+        stats[rel_filename] = (stat.st_mtime, stat.st_size)
+        if rel_filename in previous and previous[rel_filename]['stat'] == stats[rel_filename]:
+            digests[rel_filename] = previous[rel_filename]['sha256']
+        else:
+            outdated[filename] = rel_filename
+
+    for filename, digest in hash_files(sorted(outdated)).items():
+        digests[outdated[filename]] = digest
+
+    by_digest = {}
+    for rel_filename, digest in digests.items():
+        by_digest.setdefault(digest, []).append(rel_filename)
+
+    basenames = {}
+    for digest, rel_filenames in by_digest.items():
+        basenames.setdefault(os.path.basename(min(rel_filenames)), set()).add(digest)
+
+    index = {}
+    for digest, rel_filenames in by_digest.items():
+        source = min(rel_filenames)
+        filename = os.path.basename(source)
+        if len(basenames[filename]) > 1:
+            stem, ext = os.path.splitext(filename)
+            filename = '%s-%s%s' % (stem, digest[:8], ext)
+
+        page = min(docname for rel_filename in rel_filenames for docname in users[rel_filename])
+        for rel_filename in rel_filenames:
+            index[rel_filename] = {
+                'sha256': digest,
+                'filename': filename,
+                'page': page,
+                'source': source,
+                'stat': stats[rel_filename],
+            }
+
+    changed = set()
+    for rel_filename, info in index.items():
+        old_info = previous.get(rel_filename, {})
+        if (old_info.get('filename'), old_info.get('page')) != (info['filename'], info['page']):
+            changed.update(users[rel_filename])
+
+    env.confluence_attachment_index = index
+    return sorted(changed)
+
+
+def get_page_attachment_files(env, docname):
+    """
+    Attachments to upload to the page: filename -> index entry
+    """
+    index = get_attachment_index(env)
+    result = {}
+    for rel_filename in get_page_attachments(env).get(docname, ()):
+        info = index.get(rel_filename)
+        if info is not None and info['page'] == docname:
+            result[info['filename']] = info
+    return result
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""
+Native Confluence builder
+"""
+
+import io
+import json
+import os
+
+from docutils.frontend import OptionParser
+
+from sphinx.builders.html import StandaloneHTMLBuilder
+from sphinx.util.osutil import copyfile, ensuredir, os_path, relative_uri
+from sphinx.writers.html import HTMLWriter
+
+from sphinx_confluence.attachments import GeneratedAttachment, file_digest, get_page_attachment_files
+from sphinx_confluence.hierarchy import get_page_children, get_page_order, get_page_parent
+from sphinx_confluence.manifest import write_manifest
+from sphinx_confluence.registry import get_attachment_index
+from sphinx_confluence.split import get_page_title, get_split_pages
+from sphinx_confluence.util import SPHINX_VERSION, info, warning
+
+
+class BundledStream(object):
+    """
+    Page file stream that also writes the page body into the bundle
+    """
+
+    def __init__(self, stream, bundle):
+        self.stream = stream
+        self.bundle = bundle
+
+    def write(self, text):
+        self.stream.write(text)
+        self.bundle.write_body(text)
+
+
+def bundle_metadata(metadata):
+    """ Page metadata as kept in the bundle, the page name is its own field """
+    return dict((name, value) for name, value in metadata.items() if name != 'docname')
+
+
+class ConfluenceBuilder(StandaloneHTMLBuilder):
+    """
+    Writes pages in Confluence Storage Format
+
+    For every document it writes two files:
+
+    * ``<docname>.xhtml`` - storage format body made by HTMLConfluenceTranslator
+    * ``<docname>.json`` - page metadata: docname, title, parent, children and
+      attachments; parents and children of documents come from the toctrees,
+      see sphinx_confluence.hierarchy
+
+    Files attached to the pages are copied once into ``_attachments``, under
+    their attachment names (see sphinx_confluence.attachments). Attachments
+    made by the translator from the page content, such as offloaded literal
+    blocks, are written there too and listed in the page metadata as
+    ``generated_attachments``.
+
+    Sections of large documents may be split off into child pages, see
+    sphinx_confluence.split; they are written as ``<docname>--<section id>``
+    pages with the document page as their parent.
+
+    With ``confluence_validate`` set, written pages are checked to be well
+    formed, see sphinx_confluence.validate.
+
+    With ``confluence_bundle`` set, pages are also added to a single file as
+    they are written, see sphinx_confluence.bundle.
+
+    With ``confluence_targets`` set, documents are read once and written into
+    a directory per target with its own settings, see sphinx_confluence.targets.
+
+    Unlike html/json builders it does not render theme templates and does not
+    build the search index, domain indices or static files.
+    """
+
+    name = 'confluence'
+    format = 'html'
+    epilog = 'The Confluence pages are in %(outdir)s.'
+
+    copysource = False
+    out_suffix = '.xhtml'
+    link_suffix = '.xhtml'
+    metadata_suffix = '.json'
+    attachments_dir = '_attachments'
+    search = False
+    add_permalinks = False
+
+    def init(self):
+        # attachment filename -> sha256 of attachments changed on copying, see optimize_images
+        self.attachment_digests = {}
+        self.validator = None
+        # bundle pages are added to as they are written, see get_bundle
+        self.bundle = None
+        # pages split off the document being written, bundled after it
+        self.bundle_pages = []
+        self.build_info = self.create_build_info()
+        self.imagedir = '_images'
+        self.secnumbers = {}
+        self.current_docname = None
+        self.targets = []
+        if self.config.confluence_targets:
+            from sphinx_confluence.targets import get_targets
+            self.targets = get_targets(self.config)
+        self.theme = None
+        self.templates = None
+        self.init_highlighter()
+
+    def get_outdated_docs(self):
+        if not self.targets:
+            for docname in StandaloneHTMLBuilder.get_outdated_docs(self):
+                yield docname
+            return
+
+        outdir = self.outdir
+        outdated = set()
+        try:
+            for name, _ in self.targets:
+                self.outdir = os.path.join(outdir, name)
+                outdated.update(StandaloneHTMLBuilder.get_outdated_docs(self))
+        finally:
+            self.outdir = outdir
+        for docname in sorted(outdated):
+            yield docname
+
+    def write(self, build_docnames, updated_docnames, method='update'):
+        if not self.targets:
+            self.write_pages(build_docnames, updated_docnames, method)
+            return
+
+        from sphinx_confluence.targets import write_targets
+        write_targets(self.app, self.targets,
+                      lambda name: self.write_target(name, build_docnames, updated_docnames, method))
+
+    def write_target(self, name, build_docnames, updated_docnames, method):
+        """
+        Write the pages of the target into its directory, with its settings
+        """
+        from sphinx_confluence.targets import apply_overrides
+
+        overrides = dict(self.targets)[name]
+        outdir = self.outdir
+        saved = dict((setting, getattr(self.config, setting)) for setting in overrides)
+        try:
+            self.outdir = os.path.join(outdir, name)
+            ensuredir(self.outdir)
+            apply_overrides(self.config, overrides)
+            self.attachment_digests = {}
+            self.write_pages(build_docnames, updated_docnames, method)
+            self.finish_output()
+            # files build-finished writes for the whole build, the event itself is emitted once
+            from sphinx_confluence import write_profile_report
+            write_manifest(self.app, None)
+            write_profile_report(self.app, None)
+        finally:
+            self.outdir = outdir
+            apply_overrides(self.config, saved)
+            self.validator = None
+
+    def write_pages(self, build_docnames, updated_docnames, method):
+        """
+        Write the pages, drop the bundle being written if writing fails
+        """
+        try:
+            StandaloneHTMLBuilder.write(self, build_docnames, updated_docnames, method)
+        except BaseException:
+            if self.bundle is not None:
+                self.bundle.discard()
+                self.bundle = None
+            raise
+
+    def prepare_writing(self, docnames):
+        self.indexer = None
+        self.docsettings = OptionParser(
+            defaults=self.env.settings,
+            components=(HTMLWriter,),
+            read_config_files=True).get_default_values()
+        self.docsettings.compact_lists = bool(self.config.html_compact_lists)
+        if self.config.confluence_validate:
+            from sphinx_confluence.validate import PageValidator
+            self.validator = PageValidator(self.app, self.config.confluence_validate_fail_fast)
+        if self.config.confluence_bundle:
+            from sphinx_confluence.bundle import BundleWriter
+            self.bundle = BundleWriter(os.path.join(self.outdir, self.config.confluence_bundle))
+
+    def write_doc_serialized(self, docname, doctree):
+        self.imgpath = relative_uri(self.get_target_uri(docname), self.imagedir)
+        self.post_process_images(doctree)
+
+    def write_doc(self, docname, doctree):
+        doctree.settings = self.docsettings
+
+        self.secnumbers = self.env.toc_secnumbers.get(docname, {})
+        self.fignumbers = self.env.toc_fignumbers.get(docname, {})
+        self.imgpath = relative_uri(self.get_target_uri(docname), self.imagedir)
+        self.dlpath = relative_uri(self.get_target_uri(docname), '_downloads')
+        self.current_docname = docname
+
+        bundle = self.get_bundle()
+        filename = self.get_outfilename(docname)
+        ensuredir(os.path.dirname(filename))
+        with io.open(filename, 'w', encoding='utf-8') as f:
+            stream = f
+            if bundle is not None:
+                bundle.start_page(docname)
+                stream = BundledStream(f, bundle)
+            if SPHINX_VERSION < (2, 0):
+                visitor = self.create_translator(self, doctree)
+            else:
+                visitor = self.create_translator(doctree, self)
+            if self.config.confluence_stream_output:
+                # translated sections are written as soon as they are departed
+                visitor.stream = stream
+            doctree.walkabout(visitor)
+            stream.write(u''.join(visitor.fragment))
+
+        metadata = self.write_metadata(docname, visitor.generated_attachments)
+        if bundle is not None:
+            bundle.end_page(bundle_metadata(metadata))
+            for pagename, body, page_metadata in self.bundle_pages:
+                bundle.add(pagename, body, bundle_metadata(page_metadata))
+            del self.bundle_pages[:]
+        if self.validator is not None:
+            self.validator.submit(docname, filename)
+
+    def get_bundle(self):
+        """
+        Bundle the pages are added to, None without ``confluence_bundle``;
+        processes writing in parallel add them to parts of it
+        """
+        if self.bundle is not None and self.bundle.pid != os.getpid():
+            self.bundle = self.bundle.open_part()
+        return self.bundle
+
+    def get_metadata_filename(self, pagename):
+        return os.path.join(self.outdir, os_path(pagename) + self.metadata_suffix)
+
+    def get_page_metadata(self, pagename, generated_attachments=None, parent=None):
+        generated_attachments = generated_attachments or {}
+        if parent is None:
+            parent = get_page_parent(self.env, pagename)
+        return {
+            'docname': pagename,
+            'title': get_page_title(self.env, pagename),
+            'parent': parent,
+            'children': get_page_children(self.env, pagename) + [
+                page for page, _ in get_split_pages(self.env, pagename)],
+            'attachments': sorted(set(get_page_attachment_files(self.env, pagename)) | set(generated_attachments)),
+            'generated_attachments': generated_attachments,
+        }
+
+    def write_metadata(self, pagename, generated_attachments=None, parent=None):
+        metadata = self.get_page_metadata(pagename, generated_attachments, parent)
+        with open(self.get_metadata_filename(pagename), 'w') as f:
+            json.dump(metadata, f, indent=2, sort_keys=True)
+        return metadata
+
+    def write_split_page(self, pagename, body, generated_attachments):
+        """
+        Write page split off the document being written
+        """
+        filename = self.get_outfilename(pagename)
+        ensuredir(os.path.dirname(filename))
+        with io.open(filename, 'w', encoding='utf-8') as stream:
+            stream.write(body)
+        metadata = self.write_metadata(pagename, generated_attachments, parent=self.current_docname)
+        if self.bundle is not None:
+            # the line of the document being written is not complete yet
+            self.bundle_pages.append((pagename, body, metadata))
+        if self.validator is not None:
+            self.validator.submit(pagename, filename)
+
+    def read_page_metadata(self, pagename):
+        filename = self.get_metadata_filename(pagename)
+        if not os.path.isfile(filename):
+            return None
+
+        with open(filename) as f:
+            return json.load(f)
+
+    def write_generated_attachment(self, filename, data):
+        """
+        Write attachment made from the page content into the attachments directory
+
+        Names of generated attachments carry the digest of their content, so
+        an existing file is left as is.
+        """
+        attachments_dir = os.path.join(self.outdir, self.attachments_dir)
+        path = os.path.join(attachments_dir, filename)
+        if os.path.isfile(path) and os.path.getsize(path) == len(data):
+            return
+
+        ensuredir(attachments_dir)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def open_generated_attachment(self, prefix, suffix):
+        """
+        Attachment made from the page content and written as it is produced,
+        see sphinx_confluence.attachments.GeneratedAttachment
+        """
+        attachments_dir = os.path.join(self.outdir, self.attachments_dir)
+        ensuredir(attachments_dir)
+        return GeneratedAttachment(attachments_dir, prefix, suffix)
+
+    def read_page_body(self, pagename):
+        filename = self.get_outfilename(pagename)
+        if not os.path.isfile(filename):
+            return None
+
+        with io.open(filename, encoding='utf-8') as f:
+            return f.read()
+
+    def copy_attachments(self):
+        index = get_attachment_index(self.env).values()
+        attachments = dict((info['filename'], info['source']) for info in index)
+        if not attachments:
+            return
+
+        optimized = {}
+        if self.config.confluence_image_optimize:
+            optimized = self.optimize_images(dict((info['filename'], info) for info in index))
+
+        attachments_dir = os.path.join(self.outdir, self.attachments_dir)
+        ensuredir(attachments_dir)
+        for filename, source in sorted(attachments.items()):
+            copyfile(optimized.get(filename, os.path.join(self.srcdir, source)),
+                     os.path.join(attachments_dir, filename))
+
+    def optimize_images(self, attachments):
+        """
+        Downscale and recompress attached images, see sphinx_confluence.imaging
+
+        :param attachments: attachment filename -> attachment index entry
+        :return: attachment filename -> optimized file
+        """
+        from sphinx_confluence import imaging
+
+        if imaging.load_pillow() is None:
+            warning(self.app, 'confluence_image_optimize needs Pillow, images are attached as they are')
+            return {}
+
+        max_width = self.config.confluence_image_max_width
+        widths = imaging.attachment_widths(self.env, int(max_width) if max_width else None)
+        sources = dict(
+            (os.path.join(self.srcdir, attachments[filename]['source']), filename) for filename in widths)
+        results, processed = imaging.optimize_images(
+            [(source, attachments[filename]['sha256'], widths[filename]) for source, filename in sources.items()],
+            os.path.join(self.doctreedir, imaging.CACHE_DIR), int(self.config.confluence_image_quality))
+
+        optimized = {}
+        saved = 0
+        for source, target in results.items():
+            filename = sources[source]
+            optimized[filename] = target
+            self.attachment_digests[filename] = file_digest(target)
+            saved += os.path.getsize(source) - os.path.getsize(target)
+        info(self.app, 'optimized %d images (%d processed, %d cached), %d bytes saved' % (
+            len(results), processed, len(results) - processed, saved))
+        return optimized
+
+    def finish_bundle(self):
+        """
+        Add pages not written in this build to the bundle and move it into
+        place, see sphinx_confluence.bundle
+
+        Pages are copied from the previous bundle unless their metadata was
+        written after it, by a build without the bundle; those are read from
+        the output directory.
+        """
+        from sphinx_confluence.bundle import BundleWriter, open_bundle
+
+        bundle, self.bundle = self.bundle, None
+        if bundle is None:
+            bundle = BundleWriter(os.path.join(self.outdir, self.config.confluence_bundle))
+        with bundle:
+            bundle.append_parts()
+            written = len(bundle.index)
+            previous = open_bundle(bundle.filename)
+            try:
+                for pagename in get_page_order(self.env):
+                    if pagename in bundle.index:
+                        continue
+                    if previous is not None and pagename in previous and self.is_bundled(pagename, previous):
+                        bundle.add_line(pagename, previous.line(pagename))
+                        continue
+                    body = self.read_page_body(pagename)
+                    if body is None:
+                        continue
+                    metadata = self.read_page_metadata(pagename) or self.get_page_metadata(pagename)
+                    bundle.add(pagename, body, bundle_metadata(metadata))
+            finally:
+                if previous is not None:
+                    previous.close()
+        info(self.app, 'packed %d pages into %s, %d written in this build' % (
+            len(bundle.index), self.config.confluence_bundle, written))
+
+    def is_bundled(self, pagename, previous):
+        """ Whether the page in the previous bundle is the page in the output directory """
+        try:
+            return os.path.getmtime(self.get_metadata_filename(pagename)) < os.path.getmtime(previous.file.name)
+        except OSError:
+            return False
+
+    def finish(self):
+        if not self.targets:
+            # with targets, every target finishes its own output, see write_target
+            self.finish_output()
+
+    def finish_output(self):
+        if self.validator is not None:
+            self.validator.finish()
+        self.copy_attachments()
+        if self.config.confluence_bundle:
+            self.finish_bundle()
+        self.write_buildinfo()
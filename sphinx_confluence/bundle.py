@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Single-file bundle of the pages written by the confluence builder
+
+With ``confluence_bundle = 'confluence.ndjson'`` the builder packs every page
+into one NDJSON file in the output directory, a JSON object per line::
+
+    {"page": "<page>", "body": "<storage format>", "title": "...", "parent": "...",
+     "children": [...], "attachments": ["<attachment filename>", ...]}
+
+and ends it with an offset index line::
+
+    {"version": 1, "pages": {"<page>": [<offset>, <length>]}}
+
+Pages are added to the bundle as the builder writes them, the body of a
+streamed page (``confluence_stream_output``) piece by piece, so the bodies are
+never kept in memory. Processes writing in parallel add their pages to parts
+of the bundle, appended to it when it is closed. Pages not written in the
+build are copied from the previous bundle. Attachment files stay in
+``_attachments``.
+
+The bundle is written to ``<bundle>.tmp`` and moved into place with a single
+rename, so readers see either the old bundle or the new one, never a page
+list and an index that disagree. BundleReader maps the file into memory and
+reads a single page without parsing the others::
+
+    with BundleReader('_build/confluence/confluence.ndjson') as bundle:
+        page = bundle['index']
+"""
+
+import json
+import mmap
+import os
+import tempfile
+
+BUNDLE_VERSION = 1
+
+# os.rename replaces atomically on POSIX, Python 2 has no os.replace
+_replace = getattr(os, 'replace', os.rename)
+
+_PAGE_START = b'{"page": '
+_BODY_START = b', "body": "'
+
+
+class BundleWriter(object):
+    """
+    Appends pages to the bundle, appends the index and moves it into place on close
+
+    Every page line is flushed once complete, so a process forked while the
+    bundle is open never writes it again.
+
+    :param part: write a part of the bundle, see open_part
+    """
+
+    def __init__(self, filename, part=False):
+        self.filename = filename
+        self.temporary = filename + '.tmp'
+        self.pid = os.getpid()
+        self.part = part
+        self.index = {}
+        self.offset = 0
+        self.page = None
+        if part:
+            directory, name = os.path.split(self.temporary)
+            fd, self.temporary = tempfile.mkstemp(prefix=name + '.', dir=directory or None)
+            self.stream = os.fdopen(fd, 'wb')
+        else:
+            self.discard_parts()
+            self.stream = open(self.temporary, 'wb')
+
+    def open_part(self):
+        """
+        Writer of the part of the bundle written by this process, the bundle
+        writer of the parent process appends it on close
+        """
+        return BundleWriter(self.filename, part=True)
+
+    def start_page(self, page):
+        """ Start the line of the page, its body follows with write_body """
+        self.page = page
+        self.stream.write(_PAGE_START + json.dumps(page).encode('ascii') + _BODY_START)
+
+    def write_body(self, text):
+        # escaped by json.dumps piece by piece, as the body is escaped whole
+        self.stream.write(json.dumps(text)[1:-1].encode('ascii'))
+
+    def end_page(self, metadata):
+        rest = json.dumps(metadata, sort_keys=True)
+        self.stream.write(b'"' + (b', ' + rest[1:].encode('ascii') if metadata else b'}') + b'\n')
+        self.stream.flush()
+        self.note_page(self.page, self.stream.tell() - self.offset)
+        self.page = None
+
+    def add(self, page, body, metadata):
+        self.start_page(page)
+        self.write_body(body)
+        self.end_page(metadata)
+
+    def add_line(self, page, line):
+        """ Add the line of the page copied from another bundle or a part """
+        self.stream.write(line)
+        self.note_page(page, len(line))
+
+    def note_page(self, page, size):
+        self.index[page] = [self.offset, size - 1]
+        self.offset += size
+
+    def get_parts(self):
+        """ Part files of the bundle, see open_part """
+        directory, name = os.path.split(self.temporary)
+        return [os.path.join(directory, filename) for filename in os.listdir(directory or os.curdir)
+                if filename.startswith(name + '.')]
+
+    def append_parts(self):
+        """
+        Append the pages written by processes writing in parallel, in the
+        order of their first pages, the order of a serial write
+        """
+        parts = []
+        for filename in self.get_parts():
+            with open(filename, 'rb') as f:
+                parts.append((page_of_line(f.readline()), filename))
+        for _, filename in sorted(parts, key=lambda part: part[0] or ''):
+            with open(filename, 'rb') as f:
+                for line in f:
+                    self.add_line(page_of_line(line), line)
+            os.remove(filename)
+
+    def close(self):
+        try:
+            index = json.dumps({'version': BUNDLE_VERSION, 'pages': self.index}, sort_keys=True)
+            self.stream.write(index.encode('ascii') + b'\n')
+            self.stream.close()
+            _replace(self.temporary, self.filename)
+        finally:
+            self.discard()
+
+    def discard(self):
+        """ Drop the bundle being written, if it was not moved into place """
+        self.stream.close()
+        if os.path.exists(self.temporary):
+            os.remove(self.temporary)
+        if not self.part:
+            self.discard_parts()
+
+    def discard_parts(self):
+        for filename in self.get_parts():
+            os.remove(filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def page_of_line(line):
+    """ Page name of a page line of the bundle, without parsing its body """
+    if not line.startswith(_PAGE_START):
+        return None
+    return json.loads(line[len(_PAGE_START):line.index(_BODY_START)].decode('ascii'))
+
+
+def open_bundle(filename):
+    """ BundleReader of the bundle, None if there is no readable one """
+    try:
+        return BundleReader(filename)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class BundleReader(object):
+    """
+    Random access to the pages of a bundle
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        self.map = None
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            # the index is the last line, lines of pages never hold a raw newline
+            index = json.loads(self.map[self.map.rfind(b'\n', 0, len(self.map) - 1) + 1:].decode('ascii'))
+        except ValueError:
+            index = None
+        if not isinstance(index, dict) or index.get('version') != BUNDLE_VERSION:
+            self.close()
+            raise ValueError('%s: not a bundle of version %d' % (filename, BUNDLE_VERSION))
+        self.index = index['pages']
+
+    def pages(self):
+        """ Page names in bundle order """
+        return sorted(self.index, key=lambda page: self.index[page][0])
+
+    def __contains__(self, page):
+        return page in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, page):
+        offset, length = self.index[page]
+        return json.loads(self.map[offset:offset + length].decode('ascii'))
+
+    def line(self, page):
+        """ Line of the page as stored, with its newline """
+        offset, length = self.index[page]
+        return self.map[offset:offset + length + 1]
+
+    def __iter__(self):
+        for page in self.pages():
+            yield self[page]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
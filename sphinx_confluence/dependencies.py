@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Pages to write again when documents they refer to change
+
+Sphinx writes again the documents it read (changed sources and their
+includes) but not the documents referring to them, whose links carry the
+titles and anchors of their targets. Labels (``:ref:``) and documents
+(``:doc:``) referred to by every document are indexed when it is read; once
+the changed documents are read, documents referring to their labels (before
+and after the change) or to them are written again too.
+"""
+
+from sphinx import addnodes
+from sphinx.util import docname_join
+
+from sphinx_confluence.registry import get_env_registry
+
+
+def get_page_references(env):
+    """ Maps docname to the labels and documents it refers to: {"labels": [...], "docs": [...]} """
+    return get_env_registry(env, 'references')
+
+
+def get_labels(env, docnames):
+    """
+    Labels defined in the documents
+    """
+    domaindata = env.domaindata.get('std', {})
+    labels = set()
+    for name in ('labels', 'anonlabels'):
+        labels.update(label for label, target in domaindata.get(name, {}).items() if target[0] in docnames)
+    return labels
+
+
+def process_page_references(app, doctree):
+    """
+    Index labels and documents the document refers to
+    """
+    env = app.builder.env
+    labels = set()
+    docs = set()
+    for node in doctree.traverse(addnodes.pending_xref):
+        if node.get('refdomain') not in ('std', ''):
+            continue
+        if node['reftype'] in ('ref', 'numref'):
+            labels.add(node['reftarget'].lower())
+        elif node['reftype'] == 'doc':
+            docs.add(docname_join(env.docname, node['reftarget']))
+    get_page_references(env)[env.docname] = {'labels': sorted(labels), 'docs': sorted(docs)}
+
+
+def note_read_docs(app, env, docnames):
+    """
+    Remember documents about to be read and the labels they define before the change
+    """
+    app.confluence_read_docs = (set(docnames), get_labels(env, docnames))
+
+
+def get_referring_docs(app, env):
+    """
+    Documents referring to the documents just read, to be written again
+    """
+    docnames, labels = getattr(app, 'confluence_read_docs', (set(), set()))
+    app.confluence_read_docs = (set(), set())
+    if not docnames:
+        return []
+
+    labels = labels | get_labels(env, docnames)
+    return sorted(
+        docname for docname, references in get_page_references(env).items()
+        if docname not in docnames and (labels.intersection(references['labels']) or
+                                        docnames.intersection(references['docs']))
+    )
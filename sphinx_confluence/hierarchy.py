@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Page hierarchy from the toctrees
+
+The toctree directive still renders the Confluence ``toc`` macro, but its
+entries are kept (see sphinx_confluence.TocTree), so Sphinx knows the
+document tree and the extension derives the page hierarchy from it: every
+document is a child of the first document whose toctree includes it, walking
+from ``master_doc``. Documents no toctree reaches are top level pages.
+
+Toctrees of every document are kept in the environment::
+
+    {"entries": [["<title or null>", "<docname or url>"]], "glob": false,
+     "hidden": false, "maxdepth": -1, "caption": null}
+
+The hierarchy is made once all documents are read::
+
+    {"order": ["<docname>", ...], "parents": {"<docname>": "<parent docname or null>"}}
+
+``order`` lists parents before their children and children in toctree order.
+"""
+
+from sphinx import addnodes
+
+from sphinx_confluence.registry import get_env_registry
+from sphinx_confluence.split import get_split_pages
+
+
+def get_page_toctrees(env):
+    """ Maps docname to its toctrees, see module docstring """
+    return get_env_registry(env, 'toctrees')
+
+
+def get_page_hierarchy(env):
+    """ Page hierarchy of the documents, see module docstring """
+    if not hasattr(env, 'confluence_hierarchy'):
+        env.confluence_hierarchy = {'order': [], 'parents': {}}
+    return env.confluence_hierarchy
+
+
+def get_page_parent(env, docname):
+    return get_page_hierarchy(env)['parents'].get(docname)
+
+
+def get_page_children(env, docname):
+    """ Documents included by the toctrees of the document, in the page hierarchy """
+    parents = get_page_hierarchy(env)['parents']
+    children = []
+    for toctree in get_page_toctrees(env).get(docname, []):
+        for _, ref in toctree['entries']:
+            if parents.get(ref) == docname and ref not in children:
+                children.append(ref)
+    return children
+
+
+def get_page_order(env):
+    """
+    Documents and pages split off them, parents before children
+    """
+    order = get_page_hierarchy(env)['order']
+    docnames = order + sorted(set(env.found_docs) - set(order))
+    pages = []
+    for docname in docnames:
+        pages.append(docname)
+        pages.extend(page for page, _ in get_split_pages(env, docname))
+    return pages
+
+
+def process_page_toctrees(app, doctree):
+    """
+    Keep toctrees of the document
+    """
+    env = app.builder.env
+    toctrees = []
+    for node in doctree.traverse(addnodes.toctree):
+        toctrees.append({
+            'entries': [[title, ref] for title, ref in node['entries']],
+            'glob': node.get('glob', False),
+            'hidden': node.get('confluence_hidden', node.get('hidden', False)),
+            'maxdepth': node.get('maxdepth', -1),
+            'caption': node.get('caption'),
+        })
+    get_page_toctrees(env)[env.docname] = toctrees
+
+
+def make_hierarchy(docnames, toctrees, master_doc):
+    """
+    Page hierarchy of the documents, see module docstring
+
+    :param toctrees: docname -> toctrees, see get_page_toctrees
+    """
+    order = []
+    parents = {}
+
+    def visit(docname, parent):
+        # iterative preorder, so deep trees do not hit the recursion limit
+        stack = [(docname, parent)]
+        while stack:
+            docname, parent = stack.pop()
+            if docname in parents:
+                continue
+            parents[docname] = parent
+            order.append(docname)
+            children = [ref for toctree in toctrees.get(docname, []) for _, ref in toctree['entries']
+                        if ref in docnames and ref not in parents]
+            stack.extend((child, docname) for child in reversed(children))
+
+    if master_doc in docnames:
+        visit(master_doc, None)
+    for docname in sorted(docnames):
+        visit(docname, None)
+    return {'order': order, 'parents': parents}
+
+
+def update_page_hierarchy(app, env):
+    """
+    Make the page hierarchy once all documents are read
+
+    Returns documents whose parent changed, with their old and new parents,
+    so the parent and children in their metadata are written again.
+
+    :type app: sphinx.application.Sphinx
+    :type env: sphinx.environment.BuildEnvironment
+    """
+    previous = get_page_hierarchy(env)['parents']
+    hierarchy = make_hierarchy(set(env.all_docs), get_page_toctrees(env), env.config.master_doc)
+    env.confluence_hierarchy = hierarchy
+
+    parents = hierarchy['parents']
+    changed = set()
+    for docname in set(previous) | set(parents):
+        if previous.get(docname) != parents.get(docname):
+            changed.update((docname, previous.get(docname), parents.get(docname)))
+    return sorted(changed & set(env.all_docs))
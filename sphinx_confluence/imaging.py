@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Downscaling and recompression of attached images
+
+Enabled by ``confluence_image_optimize = True`` in conf.py, needs Pillow.
+PNG and JPEG attachments are resized to the largest width they are shown with
+(the ``width`` option of the image directive, in pixels) or to
+``confluence_image_max_width``, whichever is smaller, and recompressed
+(``confluence_image_quality`` for JPEG). Images are never enlarged, and the
+original is kept when the result is not smaller.
+
+Results are cached in the doctree directory under the SHA-256 of the source
+and the parameters, so unchanged images are never processed again. The
+images to process are spread over a process pool.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+
+from docutils import nodes
+from sphinx.util.osutil import ensuredir
+
+from sphinx_confluence.registry import get_attachment_index, get_env_registry
+
+#: Bumped when the processing changes, so cached results are not reused
+PIPELINE_VERSION = 1
+
+CACHE_DIR = 'confluence-images'
+FORMATS = {'.png': 'PNG', '.jpg': 'JPEG', '.jpeg': 'JPEG'}
+
+_WIDTH_RE = re.compile(r'^\s*(\d+)\s*(px)?\s*$')
+
+
+def load_pillow():
+    """
+    PIL.Image module, None if Pillow is not installed
+
+    Imported on demand, it is slow to import and only needed here.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+def get_image_widths(env):
+    """ Maps docname to widths of its images: source path -> width in pixels or None """
+    return get_env_registry(env, 'image_widths')
+
+
+def parse_width(width):
+    """
+    Width of the image directive in pixels, None for other units
+    """
+    match = _WIDTH_RE.match(width or '')
+    return int(match.group(1)) if match else None
+
+
+def widest(width, other):
+    """ Larger of two widths, None (natural size) wins """
+    return None if width is None or other is None else max(width, other)
+
+
+def attachment_widths(env, max_width=None):
+    """
+    Width each attached image is scaled to: attachment filename -> pixels or None (keep size)
+
+    An image shown anywhere without width or with a relative one keeps its size
+    up to ``max_width``.
+    """
+    index = get_attachment_index(env)
+    widths = {}
+    for image_widths in get_image_widths(env).values():
+        for rel_filename, width in image_widths.items():
+            info = index.get(rel_filename)
+            if info is None:
+                continue
+            filename = info['filename']
+            widths[filename] = widest(widths[filename], width) if filename in widths else width
+
+    if max_width:
+        for filename, width in widths.items():
+            widths[filename] = min(width or max_width, max_width)
+    return widths
+
+
+def optimize_image(job):
+    """
+    Scale and recompress the image into the cache file
+
+    Runs in pool workers. Returns the size of the result.
+    """
+    source, target, width, quality = job
+    Image = load_pillow()
+    image_format = FORMATS[os.path.splitext(source)[1].lower()]
+    image = Image.open(source)
+    image.load()
+    if width and image.size[0] > width:
+        height = max(1, int(round(image.size[1] * float(width) / image.size[0])))
+        image = image.resize((width, height), getattr(Image, 'LANCZOS', None) or Image.ANTIALIAS)
+
+    options = {'optimize': True}
+    if image_format == 'JPEG':
+        options['quality'] = quality
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+    temporary = target + '.tmp%d' % os.getpid()
+    image.save(temporary, image_format, **options)
+    if os.path.getsize(temporary) >= os.path.getsize(source):
+        os.remove(temporary)
+        shutil.copyfile(source, temporary)
+    os.rename(temporary, target)
+    return os.path.getsize(target)
+
+
+def optimize_images(sources, cache_dir, quality, processes=None):
+    """
+    Optimize images, reusing cached results
+
+    :param sources: list of (source path, sha256, width)
+    :return: source path -> optimized file in the cache, and number of images processed
+    """
+    ensuredir(cache_dir)
+    results = {}
+    jobs = []
+    for source, digest, width in sources:
+        key = hashlib.sha256(('%s:%s:%s:%s' % (digest, width, quality, PIPELINE_VERSION)).encode('ascii'))
+        target = os.path.join(cache_dir, key.hexdigest()[:32] + os.path.splitext(source)[1].lower())
+        results[source] = target
+        if not os.path.isfile(target):
+            jobs.append((source, target, width, quality))
+
+    if len(jobs) > 1:
+        # imported here as only uncached images need it
+        from multiprocessing import Pool, cpu_count
+
+        pool = Pool(min(len(jobs), processes or cpu_count()))
+        try:
+            pool.map(optimize_image, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            optimize_image(job)
+
+    return results, len(jobs)
+
+
+def process_image_widths(app, doctree):
+    """
+    Register widths the attached images of the document are shown with
+    """
+    env = app.builder.env
+    widths = {}
+    for node in doctree.traverse(nodes.image):
+        rel_filename = node.get('confluence_attachment')
+        if rel_filename is None or os.path.splitext(rel_filename)[1].lower() not in FORMATS:
+            continue
+        width = parse_width(node.get('width'))
+        widths[rel_filename] = widest(widths[rel_filename], width) if rel_filename in widths else width
+    get_image_widths(env)[env.docname] = widths
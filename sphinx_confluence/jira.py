@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Jira issue references
+
+``:jira_issue:`` roles become jira_issue nodes, rendered by
+HTMLConfluenceTranslator according to the Jira mode of the page: the
+``:jira_mode:`` field of the document metadata, or ``confluence_jira_mode``.
+
+* ``inline`` - a Jira macro for every reference; each one is a Jira lookup on
+  every page view
+* ``batch`` - a single Jira Issues macro at the end of the page, with the JQL
+  ``key in (...)`` of all the issues referenced on the page; references link
+  to it
+* ``static`` - issue key and summary taken at build time from the
+  ``confluence_jira_snapshot`` file, page views never reach Jira
+
+The snapshot is a JSON file: the response of the Jira search REST API
+(``{"issues": [...]}``), a list of such issues, or an object mapping issue key
+to ``{"summary": ..., "status": ..., "url": ...}``.
+
+The ``jira_issues`` directive becomes a jira_issues node, rendered as a Jira
+Issues macro when the page is written, so the Jira server of the output
+(``confluence_jira_server_id`` and ``confluence_jira_baseurl``, used where the
+directive does not set ``server_id`` and ``baseurl``) may differ between
+targets, see sphinx_confluence.targets.
+"""
+
+import json
+import os
+
+from docutils import nodes
+
+from sphinx_confluence import macros
+from sphinx_confluence.util import TRANSLATED_BUILDERS, warning
+
+JIRA_MODES = ('inline', 'batch', 'static')
+
+#: Anchor of the batched Jira Issues macro
+BATCH_ANCHOR = 'jira-issues'
+
+
+class jira_issue(nodes.Inline, nodes.TextElement):
+    """ Reference to the Jira issue, its text is the issue key """
+
+
+class jira_issues(nodes.General, nodes.Element):
+    """ Jira Issues macro: ``parameters`` of the directive and its ``jql`` """
+
+
+def issues_parameters(node, config):
+    """
+    (name, value) parameters of the Jira Issues macro of the jira_issues node
+    """
+    parameters = dict(node['parameters'])
+    if config.confluence_jira_server_id:
+        parameters.setdefault('serverId', config.confluence_jira_server_id)
+    if config.confluence_jira_baseurl:
+        parameters.setdefault('baseurl', config.confluence_jira_baseurl)
+    return sorted(parameters.items()) + [('jqlQuery', node['jql'])]
+
+
+def render_jira_issues(node, config):
+    return macros.jira_issues(issues_parameters(node, config), config.confluence_compact_macros)
+
+
+def get_jira_mode(app, docname):
+    """
+    Jira mode of the document, see module docstring
+
+    :type app: sphinx.application.Sphinx
+    """
+    env = app.builder.env
+    mode = env.metadata.get(docname, {}).get('jira_mode') or env.config.confluence_jira_mode
+    if mode not in JIRA_MODES:
+        warning(app, '%s: unknown Jira mode %r, use one of %s' % (docname, mode, ', '.join(JIRA_MODES)))
+        return 'inline'
+    return mode
+
+
+def get_snapshot_filename(config, confdir):
+    if not config.confluence_jira_snapshot:
+        return None
+    return os.path.join(confdir, config.confluence_jira_snapshot)
+
+
+def parse_snapshot(data):
+    """
+    Issues of the snapshot by key: {"summary": ..., "status": ..., "url": ...}
+    """
+    if isinstance(data, dict) and 'issues' in data:
+        data = data['issues']
+    if isinstance(data, dict):
+        return dict((key, {'summary': issue.get('summary'), 'status': issue.get('status'), 'url': issue.get('url')})
+                    for key, issue in data.items())
+
+    issues = {}
+    for issue in data:
+        fields = issue.get('fields', {})
+        status = fields.get('status')
+        url = None
+        if '/rest/' in issue.get('self', ''):
+            url = '%s/browse/%s' % (issue['self'].split('/rest/', 1)[0], issue['key'])
+        issues[issue['key']] = {
+            'summary': fields.get('summary'),
+            'status': status.get('name') if isinstance(status, dict) else status,
+            'url': url,
+        }
+    return issues
+
+
+def get_snapshots(env):
+    """
+    Maps snapshot filename to [mtime, issues by key], cached in the build environment
+    """
+    if not hasattr(env, 'confluence_jira_snapshots'):
+        env.confluence_jira_snapshots = {}
+    return env.confluence_jira_snapshots
+
+
+def load_snapshot(app, filename):
+    """
+    Issues of the snapshot file by key, reloaded when the file changes
+
+    A snapshot that cannot be read is warned about once and has no issues,
+    references are then rendered as without a snapshot.
+    """
+    snapshots = get_snapshots(app.builder.env)
+    try:
+        mtime = os.path.getmtime(filename)
+    except OSError:
+        mtime = None
+    cached = snapshots.get(filename)
+    if cached is None or cached[0] != mtime:
+        try:
+            with open(filename) as f:
+                issues = parse_snapshot(json.load(f))
+        except (IOError, OSError, ValueError) as e:
+            warning(app, 'cannot read Jira snapshot %s: %s' % (filename, e))
+            issues = {}
+        cached = snapshots[filename] = [mtime, issues]
+    return cached[1]
+
+
+def process_jira_issues(app, doctree):
+    """
+    Make documents with static Jira issues depend on the snapshot
+    """
+    env = app.builder.env
+    filename = get_snapshot_filename(app.config, app.confdir)
+    if filename is None or get_jira_mode(app, env.docname) != 'static':
+        return
+    for _ in doctree.traverse(jira_issue):
+        env.note_dependency(filename)
+        break
+
+
+def resolve_jira_issues(app, doctree, docname):
+    """
+    Replace Jira issues with their keys and Jira Issues macros with raw
+    storage format for builders that do not render them
+    """
+    if app.builder.name in TRANSLATED_BUILDERS:
+        return
+    for node in doctree.traverse(jira_issue):
+        node.replace_self(nodes.Text(node.astext()))
+    for node in doctree.traverse(jira_issues):
+        node.replace_self(nodes.raw('', render_jira_issues(node, app.config), format='html'))
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Deprecated ``json_conf`` builder
+
+Kept apart from the extension so that builds with other builders do not import
+it. Sphinx 1.6+ loads it through the ``sphinx.builders`` entry point when
+``-b json_conf`` is requested (or add ``sphinx_confluence.json_conf`` to
+``extensions`` when the package is not installed); older Sphinx versions get
+it registered by the extension itself.
+"""
+
+try:
+    from sphinx.builders.html import JSONHTMLBuilder
+except ImportError:
+    from sphinxcontrib.serializinghtml import JSONHTMLBuilder
+
+from sphinx_confluence.util import SPHINX_VERSION, warning
+
+
+class JSONConfluenceBuilder(JSONHTMLBuilder):
+    """For backward compatibility"""
+
+    name = 'json_conf'
+
+    def __init__(self, app):
+        super(JSONConfluenceBuilder, self).__init__(app)
+        if SPHINX_VERSION >= (1, 4):
+            from sphinx_confluence import HTMLConfluenceTranslator
+            self.translator_class = HTMLConfluenceTranslator
+        warning(app, 'json_conf builder is deprecated and will be removed in future releases')
+
+
+def setup(app):
+    """
+    :type app: sphinx.application.Sphinx
+    """
+    app.setup_extension('sphinx_confluence')
+    app.add_builder(JSONConfluenceBuilder)
+
+    return {
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
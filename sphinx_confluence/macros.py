@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Templates of the Confluence macros emitted by the extension
+
+Every template exists in two precompiled forms: the indented one the
+extension always produced, and a compact one without whitespace between
+tags, used with ``confluence_compact_macros = True``. Confluence ignores that
+whitespace, so the compact form only makes pages smaller.
+"""
+
+import re
+
+TEMPLATES = {
+    'admonition_start': """\
+            <ac:structured-macro ac:name="{name}">
+              <ac:parameter ac:name="icon">true</ac:parameter>
+              <ac:parameter ac:name="title"></ac:parameter>
+              <ac:rich-text-body>
+        """,
+    'admonition_end': """
+              </ac:rich-text-body>
+            </ac:structured-macro>\n
+        """,
+    'anchor': """
+            <ac:structured-macro ac:name="anchor">
+              <ac:parameter ac:name="">{name}</ac:parameter>
+            </ac:structured-macro>
+        """,
+    'toc': """
+            <ac:structured-macro ac:name="toc">
+              <ac:parameter ac:name="style">square</ac:parameter>
+              <ac:parameter ac:name="minLevel">1</ac:parameter>
+              <ac:parameter ac:name="maxLevel">3</ac:parameter>
+              <ac:parameter ac:name="type">list</ac:parameter>
+            </ac:structured-macro>\n
+        """,
+    'expand_start': """
+            <ac:structured-macro ac:name="expand">
+              <ac:parameter ac:name="title">{title}</ac:parameter>
+              <ac:rich-text-body>
+        """,
+    'expand_end': """
+              </ac:rich-text-body>
+            </ac:structured-macro>\n
+        """,
+    'include': """
+            <ac:structured-macro ac:name="include">
+              <ac:parameter ac:name="">
+                <ac:link><ri:page ri:content-title="{title}" /></ac:link>
+              </ac:parameter>
+            </ac:structured-macro>
+        """,
+    'jira_issue': """\
+          <ac:structured-macro ac:name="jira" ac:schema-version="1">
+            <ac:parameter ac:name="key">{key}</ac:parameter>
+            <ac:parameter ac:name="showSummary">false</ac:parameter>
+          </ac:structured-macro>
+        """,
+    'jira_issue_link': """\
+          <ac:link ac:anchor="{anchor}">
+            <ac:plain-text-link-body>{body}</ac:plain-text-link-body>
+          </ac:link>
+        """,
+    'jira_user': """\
+        <ac:link>
+            <ri:user ri:username="{username}"/>
+        </ac:link>
+        """,
+    # joined with newlines in the indented form, see jira_issues
+    'jira_issues_start': '<ac:structured-macro ac:name="jira" ac:schema-version="1">',
+    'jira_issues_parameter': '<ac:parameter ac:name="{name}">{value}</ac:parameter>',
+    'jira_issues_end': '</ac:structured-macro>',
+}
+
+_BETWEEN_TAGS = re.compile(r'>\s+<')
+
+
+def compact(template):
+    """
+    Drop whitespace around and between the tags of the template
+    """
+    return _BETWEEN_TAGS.sub('><', template.strip())
+
+
+COMPACT_TEMPLATES = dict((name, compact(template)) for name, template in TEMPLATES.items())
+
+
+def render(macro, compact_macros=False, **values):
+    """
+    Render macro template by name
+
+    :param compact_macros: use the whitespace-free form
+    """
+    template = (COMPACT_TEMPLATES if compact_macros else TEMPLATES)[macro]
+    return template.format(**values) if values else template
+
+
+def cdata(text):
+    """
+    CDATA section holding the text
+
+    ``]]>`` can not occur inside a CDATA section, so it is split between two
+    adjacent sections.
+    """
+    return '<![CDATA[%s]]>' % text.replace(']]>', ']]]]><![CDATA[>')
+
+
+def escape(text):
+    """
+    Escape text of an element
+    """
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def jira_issues(parameters, compact_macros=False):
+    """
+    JIRA Issues macro for the list of (name, value) parameters, values are escaped
+    """
+    parts = [render('jira_issues_start', compact_macros)]
+    parts.extend(render('jira_issues_parameter', compact_macros, name=name, value=escape('%s' % value))
+                 for name, value in parameters)
+    parts.append(render('jira_issues_end', compact_macros))
+    return ('' if compact_macros else '\n').join(parts)
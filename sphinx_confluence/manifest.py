@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Publish manifest
+
+Written at the end of the build next to the pages, it lets a publisher upload
+only what changed::
+
+    {
+      "version": 1,
+      "order": ["<page>", ...],
+      "pages": {
+        "<page>": {
+          "title": "<page title>",
+          "parent": "<parent page or null>",
+          "children": ["<page>", ...],
+          "body": "<sha256 of the normalized storage format body>",
+          "attachments": {"<attachment filename>": "<sha256 of the file>"}
+        }
+      },
+      "attachments": {
+        "<attachment filename>": {
+          "sha256": "<sha256 of the attached file>",
+          "page": "<page it is attached to>",
+          "source": "<path relative to srcdir>"
+        }
+      },
+      "changed": ["<page>", ...],
+      "removed": ["<page>", ...]
+    }
+
+Pages are documents and pages split off them (see sphinx_confluence.split),
+which are children of their document pages. Documents are children of the
+documents including them in their toctrees (see sphinx_confluence.hierarchy);
+``order`` lists every page after its parent, so pages can be created in a
+single pass. Page ``attachments`` only list
+files attached to the page itself, see
+sphinx_confluence.attachments. Attachments generated by the confluence builder
+from the page content have ``source`` set to null. ``changed`` and ``removed`` are computed
+against the manifest left by the previous build in the same output directory.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+from sphinx.util.osutil import os_path
+
+from sphinx_confluence.attachments import get_page_attachment_files
+from sphinx_confluence.hierarchy import get_page_children, get_page_order, get_page_parent
+from sphinx_confluence.split import get_page_title, get_split_pages
+
+MANIFEST_VERSION = 1
+
+_CDATA_RE = re.compile(r'(<!\[CDATA\[.*?\]\]>)', re.DOTALL)
+# a tag and the whitespace up to the next tag
+_INTERTAG_SPACE_RE = re.compile(r'(<[^<>]*>)\s+(?=(<[^<>]*>))')
+_MACRO_TAG_RE = re.compile(r'^</?(ac|ri|at):')
+
+
+def _drop_macro_space(match):
+    if _MACRO_TAG_RE.match(match.group(1)) or _MACRO_TAG_RE.match(match.group(2)):
+        return match.group(1)
+    return match.group(0)
+
+
+def normalize_body(body):
+    """
+    Normalize storage format body for hashing
+
+    Whitespace between tags is dropped where one of the tags belongs to a
+    Confluence macro (``ac:``, ``ri:``, ``at:``): it comes from the indented
+    macro templates, see sphinx_confluence.macros. Whitespace between other
+    tags may be content (``<em>a</em> <em>b</em>``) and is kept, as are CDATA
+    sections (code blocks).
+    """
+    parts = _CDATA_RE.split(body.strip())
+    for i in range(0, len(parts), 2):
+        parts[i] = _INTERTAG_SPACE_RE.sub(_drop_macro_space, parts[i])
+    return ''.join(parts)
+
+
+def body_digest(body):
+    return hashlib.sha256(normalize_body(body).encode('utf-8')).hexdigest()
+
+
+def read_page_body(builder, docname):
+    """
+    Storage format body of the page written by the builder, None if there is no such page
+
+    Only the confluence builder and serializing builders (json, pickle) keep
+    the body apart from the theme layout.
+    """
+    if hasattr(builder, 'read_page_body'):
+        return builder.read_page_body(docname)
+
+    implementation = getattr(builder, 'implementation', None)
+    if implementation is None:
+        return None
+
+    filename = os.path.join(builder.outdir, os_path(docname) + builder.out_suffix)
+    if not os.path.isfile(filename):
+        return None
+
+    with open(filename, 'rb') as f:
+        return implementation.load(f).get('body')
+
+
+def read_page_metadata(builder, pagename):
+    """
+    Page metadata written by the builder, empty for builders without sidecar files
+    """
+    if not hasattr(builder, 'read_page_metadata'):
+        return {}
+    return builder.read_page_metadata(pagename) or {}
+
+
+def get_generated_attachments(metadata):
+    """
+    Attachments the builder generated for the page, in the attachment index format
+    """
+    return dict(
+        (filename, {'filename': filename, 'sha256': digest, 'page': metadata['docname'], 'source': None})
+        for filename, digest in metadata.get('generated_attachments', {}).items()
+    )
+
+
+def load_manifest(filename):
+    try:
+        with open(filename) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest
+
+
+def write_manifest(app, exception):
+    """
+    Write publish manifest, see module docstring
+
+    :type app: sphinx.application.Sphinx
+    """
+    if exception is not None or not app.config.confluence_manifest:
+        return
+    if getattr(app.builder, 'targets', None) and app.builder.outdir == app.outdir:
+        # written by every target into its directory, see sphinx_confluence.targets
+        return
+
+    builder = app.builder
+    env = builder.env
+
+    pagenames = get_page_order(env)
+    pages = {}
+    attachments = {}
+    for pagename in pagenames:
+        body = read_page_body(builder, pagename)
+        if body is None:
+            continue
+
+        metadata = read_page_metadata(builder, pagename)
+        page_attachments = dict(get_page_attachment_files(env, pagename))
+        page_attachments.update(get_generated_attachments(metadata))
+        for filename, info in page_attachments.items():
+            # the same generated attachment may belong to several pages, the first one is listed
+            attachments.setdefault(
+                filename, {'sha256': info['sha256'], 'page': pagename, 'source': info['source']})
+
+        pages[pagename] = {
+            'title': get_page_title(env, pagename),
+            'parent': get_page_parent(env, pagename) if pagename in env.all_docs else metadata.get('parent'),
+            'children': get_page_children(env, pagename) + [page for page, _ in get_split_pages(env, pagename)],
+            'body': body_digest(body),
+            'attachments': dict((filename, info['sha256']) for filename, info in page_attachments.items()),
+        }
+
+    # attachments changed on copying (optimized images) are uploaded as written
+    for filename, digest in getattr(builder, 'attachment_digests', {}).items():
+        if filename in attachments:
+            attachments[filename]['sha256'] = digest
+            pages[attachments[filename]['page']]['attachments'][filename] = digest
+
+    if not pages:
+        return
+
+    filename = os.path.join(builder.outdir, app.config.confluence_manifest)
+    previous = load_manifest(filename).get('pages', {})
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'order': [pagename for pagename in pagenames if pagename in pages],
+        'pages': pages,
+        'attachments': attachments,
+        'changed': sorted(pagename for pagename, page in pages.items() if previous.get(pagename) != page),
+        'removed': sorted(set(previous) - set(pages)),
+    }
+
+    with open(filename, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
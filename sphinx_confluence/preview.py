@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Local preview of the pages written by the confluence builder
+
+Storage format macros are rendered to approximate HTML: admonitions, code
+blocks, anchors, links to pages and attachments, images and Jira macros;
+other macros are shown by name. Opened pages reload themselves when the
+output is rebuilt (see sphinx_confluence.watch)::
+
+    python -m sphinx_confluence.preview _build/confluence --port 8000
+"""
+
+import argparse
+import io
+import json
+import mimetypes
+import os
+import re
+import threading
+import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+try:
+    from html.entities import name2codepoint
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import quote, unquote, urlsplit
+except ImportError:  # Python 2
+    from htmlentitydefs import name2codepoint
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import quote, unquote
+    from urlparse import urlsplit
+
+from sphinx_confluence.validate import ROOT_END, ROOT_START
+
+AC = '{http://atlassian.com/content}'
+RI = '{http://atlassian.com/resource/identifier}'
+
+ADMONITIONS = ('info', 'note', 'tip', 'warning')
+
+_ENTITY_RE = re.compile(r'&([A-Za-z][A-Za-z0-9]*);')
+
+STYLE = '''
+body { font-family: sans-serif; max-width: 60em; margin: 2em auto; line-height: 1.5; }
+pre { background: #f4f5f7; padding: .5em; overflow: auto; }
+.admonition { border-left: 4px solid; padding: .2em 1em; margin: 1em 0; }
+.info { border-color: #0052cc; } .note { border-color: #ff991f; }
+.tip { border-color: #36b37e; } .warning { border-color: #de350b; }
+.macro { border: 1px dashed #999; padding: .2em .5em; color: #555; }
+.jira { background: #deebff; padding: 0 .3em; }
+'''
+
+RELOAD_SCRIPT = '''
+<script>
+var build = null;
+setInterval(function () {
+  fetch('/_build').then(function (r) { return r.text(); }).then(function (id) {
+    if (build !== null && id !== build) { location.reload(); }
+    build = id;
+  });
+}, 300);
+</script>
+'''
+
+
+def parse_body(body):
+    """
+    Storage format body as an element tree under a wrapping root element
+    """
+    body = _ENTITY_RE.sub(
+        lambda match: '&#%d;' % name2codepoint[match.group(1)] if match.group(1) in name2codepoint else match.group(0),
+        body)
+    return ElementTree.fromstring(ROOT_START + body.encode('utf-8') + ROOT_END)
+
+
+def macro_parameters(element):
+    return dict((parameter.get(AC + 'name'), parameter.text or '') for parameter in element.findall(AC + 'parameter'))
+
+
+class StorageRenderer(object):
+    """
+    Renders storage format to HTML
+
+    :param pages: page title -> page name, for links to other pages
+    """
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def render(self, body):
+        try:
+            root = parse_body(body)
+        except ElementTree.ParseError as e:
+            return '<p class="macro">Malformed storage format: %s</p><pre>%s</pre>' % (escape(str(e)), escape(body))
+        return self.children(root)
+
+    def children(self, element):
+        parts = [escape(element.text or '')]
+        for child in element:
+            parts.append(self.element(child))
+            parts.append(escape(child.tail or ''))
+        return ''.join(parts)
+
+    def element(self, element):
+        if element.tag == AC + 'structured-macro':
+            return self.macro(element)
+        if element.tag == AC + 'link':
+            return self.link(element)
+        if element.tag == AC + 'image':
+            return self.image(element)
+        if element.tag.startswith('{'):
+            return self.children(element)
+
+        attributes = ''.join(' %s=%s' % (name, quoteattr(value)) for name, value in sorted(element.attrib.items()))
+        return '<%s%s>%s</%s>' % (element.tag, attributes, self.children(element), element.tag)
+
+    def macro(self, element):
+        name = element.get(AC + 'name')
+        parameters = macro_parameters(element)
+        rich_body = element.find(AC + 'rich-text-body')
+        plain_body = element.find(AC + 'plain-text-body')
+        content = self.children(rich_body) if rich_body is not None else ''
+
+        if name in ADMONITIONS:
+            return '<div class="admonition %s">%s</div>' % (name, content)
+        if name == 'code':
+            title = parameters.get('title')
+            return '%s<pre>%s</pre>' % (
+                '<p><b>%s</b></p>' % escape(title) if title else '',
+                escape(plain_body.text or '') if plain_body is not None else '')
+        if name == 'anchor':
+            return '<a id=%s></a>' % quoteattr(parameters.get('', ''))
+        if name == 'jira':
+            if 'key' in parameters:
+                return '<span class="jira">%s</span>' % escape(parameters['key'])
+            return '<div class="jira macro">Jira issues: %s</div>' % escape(parameters.get('jqlQuery', ''))
+        return '<div class="macro">%s macro%s</div>' % (escape(name or ''), content)
+
+    def link(self, element):
+        href = '#' + element.get(AC + 'anchor') if element.get(AC + 'anchor') else '#'
+        text = None
+        page = element.find(RI + 'page')
+        attachment = element.find(RI + 'attachment')
+        user = element.find(RI + 'user')
+        if attachment is not None:
+            href = '/_attachments/' + quote(attachment.get(RI + 'filename'))
+            text = attachment.get(RI + 'filename')
+        elif page is not None:
+            title = page.get(RI + 'content-title')
+            href = '/%s%s' % (quote(self.pages.get(title, title)), href if href != '#' else '')
+            text = title
+        elif user is not None:
+            return '<span class="jira">@%s</span>' % escape(user.get(RI + 'username', ''))
+
+        link_body = element.find(AC + 'link-body')
+        plain_body = element.find(AC + 'plain-text-link-body')
+        if link_body is not None:
+            content = self.children(link_body)
+        elif plain_body is not None:
+            content = escape(plain_body.text or '')
+        else:
+            content = escape(text or href)
+        return '<a href=%s>%s</a>' % (quoteattr(href), content)
+
+    def image(self, element):
+        attachment = element.find(RI + 'attachment')
+        url = element.find(RI + 'url')
+        if attachment is not None:
+            src = '/_attachments/' + quote(attachment.get(RI + 'filename'))
+        else:
+            src = url.get(RI + 'value') if url is not None else ''
+        width = element.get(AC + 'width')
+        return '<img src=%s alt=%s%s>' % (
+            quoteattr(src), quoteattr(element.get(AC + 'alt', '')), ' width=%s' % quoteattr(width) if width else '')
+
+
+class PreviewServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, outdir):
+        HTTPServer.__init__(self, address, PreviewRequestHandler)
+        self.outdir = outdir
+        # changed by the watcher after every build, opened pages poll it
+        self.build_id = 0
+        self.lock = threading.Lock()
+        # page name -> (signature of the sidecar file, title), see pages()
+        self._titles = {}
+
+    def notify_build(self):
+        with self.lock:
+            self.build_id += 1
+
+    def pages(self):
+        """
+        Page name -> page title of the written pages
+
+        The output directory is listed on every call, as it may be rebuilt by
+        a sphinx-build the server is not told about; titles are only read
+        again from the sidecar files that changed.
+        """
+        with self.lock:
+            titles = {}
+            for dirpath, _, filenames in os.walk(self.outdir):
+                for filename in filenames:
+                    if not filename.endswith('.xhtml'):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    page = os.path.relpath(path, self.outdir)[:-len('.xhtml')].replace(os.sep, '/')
+                    sidecar = path[:-len('.xhtml')] + '.json'
+                    try:
+                        stat = os.stat(sidecar)
+                        signature = (stat.st_mtime, stat.st_size)
+                    except OSError:
+                        signature = None
+
+                    cached = self._titles.get(page)
+                    if cached is not None and cached[0] == signature:
+                        titles[page] = cached
+                        continue
+                    title = None
+                    try:
+                        with open(sidecar) as f:
+                            title = json.load(f).get('title')
+                    except (IOError, ValueError):
+                        pass
+                    titles[page] = (signature, title)
+            self._titles = titles
+            return dict((page, title or page) for page, (_, title) in titles.items())
+
+
+class PreviewRequestHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, content_type='text/html; charset=utf-8'):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def document(self, title, content):
+        return '<!DOCTYPE html><html><head><meta charset="utf-8"><title>%s</title><style>%s</style></head>' \
+               '<body>%s%s</body></html>' % (escape(title), STYLE, content, RELOAD_SCRIPT)
+
+    def do_GET(self):
+        path = unquote(urlsplit(self.path).path).lstrip('/')
+        outdir = self.server.outdir
+
+        if path == '_build':
+            return self.send(200, str(self.server.build_id), 'text/plain')
+
+        pages = self.server.pages()
+        if not path:
+            items = ''.join('<li><a href="/%s">%s</a></li>' % (quote(page), escape(title))
+                            for page, title in sorted(pages.items()))
+            return self.send(200, self.document('Pages', '<h1>Pages</h1><ul>%s</ul>' % items))
+
+        if path.startswith('_attachments/'):
+            filename = os.path.join(outdir, '_attachments', os.path.basename(path))
+            if not os.path.isfile(filename):
+                return self.send(404, 'Not found', 'text/plain')
+            with open(filename, 'rb') as f:
+                return self.send(200, f.read(), mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+
+        if path not in pages:
+            return self.send(404, self.document('Not found', '<p>No page %s</p>' % escape(path)))
+
+        with io.open(os.path.join(outdir, path + '.xhtml'), encoding='utf-8') as f:
+            body = f.read()
+        renderer = StorageRenderer(dict((title, page) for page, title in pages.items()))
+        content = '<p><a href="/">Pages</a></p><h1>%s</h1>%s' % (escape(pages[path]), renderer.render(body))
+        self.send(200, self.document(pages[path], content))
+
+
+def serve(outdir, host='127.0.0.1', port=8000):
+    """
+    Start the preview server in a background thread
+    """
+    server = PreviewServer((host, port), outdir)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local preview of the pages written by the confluence builder')
+    parser.add_argument('outdir', help='output directory of the confluence builder')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    server = PreviewServer((args.host, args.port), args.outdir)
+    print('Preview on http://%s:%s' % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Translator profiling
+
+Enabled by ``confluence_profile = True`` in conf.py. Every ``visit_*`` and
+``depart_*`` call of HTMLConfluenceTranslator is timed, and the bytes it
+appends to the body are counted, per node type and per document. Translators
+dump their figures into a temporary directory (writers may run in parallel
+processes); at the end of the build they are merged into
+``confluence-profile.json`` in the output directory::
+
+    {
+      "nodes": {"<node type>": {"calls": 12, "time": 0.0123, "bytes": 3456}},
+      "documents": {"<docname>": {"calls": 120, "time": 0.123, "bytes": 34567}},
+      "unknown": {"<node type>": 3}
+    }
+
+and the node types taking most time are logged (``confluence_profile_top``).
+``unknown`` counts nodes the translator has no visitor for.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from sphinx.util.osutil import ensuredir
+
+from sphinx_confluence.util import info
+
+PROFILE_DIR = '.confluence-profile'
+REPORT = 'confluence-profile.json'
+
+
+def _add(stats, name, calls, elapsed, size):
+    entry = stats.setdefault(name, {'calls': 0, 'time': 0.0, 'bytes': 0})
+    entry['calls'] += calls
+    entry['time'] += elapsed
+    entry['bytes'] += size
+
+
+class TranslatorProfile(object):
+    """
+    Figures of one translated document
+    """
+
+    def __init__(self, translator):
+        self.translator = translator
+        self.nodes = {}
+        self.unknown = {}
+
+    def install(self):
+        """
+        Replace dispatch methods of the translator with timed ones
+
+        Dispatch is only wrapped on this instance, translators without
+        profiling run the original methods.
+        """
+        translator = self.translator
+        translator.dispatch_visit = self.wrap(translator.dispatch_visit)
+        translator.dispatch_departure = self.wrap(translator.dispatch_departure)
+
+    def wrap(self, dispatch):
+        translator = self.translator
+
+        def timed_dispatch(node):
+            body = translator.body
+            length = len(body)
+            start = time.time()
+            try:
+                return dispatch(node)
+            finally:
+                elapsed = time.time() - start
+                # the body may have been flushed to the output stream or
+                # replaced by the body of a split-off page meanwhile
+                if translator.body is not body or len(body) < length:
+                    body, length = translator.body, 0
+                size = sum(len(part) for part in body[length:])
+                _add(self.nodes, node.__class__.__name__, 1, elapsed, size)
+
+        return timed_dispatch
+
+    def note_unknown(self, node):
+        name = node.__class__.__name__
+        self.unknown[name] = self.unknown.get(name, 0) + 1
+
+    def dump(self, outdir, docname):
+        profile_dir = os.path.join(outdir, PROFILE_DIR)
+        ensuredir(profile_dir)
+        filename = hashlib.md5(docname.encode('utf-8')).hexdigest() + '.json'
+        with open(os.path.join(profile_dir, filename), 'w') as f:
+            json.dump({'docname': docname, 'nodes': self.nodes, 'unknown': self.unknown}, f)
+
+
+def write_profile_report(app, exception):
+    """
+    Merge figures dumped by translators into the report, log the summary
+
+    :type app: sphinx.application.Sphinx
+    """
+    profile_dir = os.path.join(app.builder.outdir, PROFILE_DIR)
+    if not os.path.isdir(profile_dir):
+        return
+
+    report = {'nodes': {}, 'documents': {}, 'unknown': {}}
+    try:
+        if exception is not None:
+            return
+
+        for filename in sorted(os.listdir(profile_dir)):
+            with open(os.path.join(profile_dir, filename)) as f:
+                profile = json.load(f)
+            for name, entry in profile['nodes'].items():
+                _add(report['nodes'], name, entry['calls'], entry['time'], entry['bytes'])
+                _add(report['documents'], profile['docname'], entry['calls'], entry['time'], entry['bytes'])
+            for name, count in profile['unknown'].items():
+                report['unknown'][name] = report['unknown'].get(name, 0) + count
+    finally:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+
+    with open(os.path.join(app.builder.outdir, REPORT), 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    total = sum(entry['time'] for entry in report['nodes'].values()) or 1.0
+    top = sorted(report['nodes'].items(), key=lambda item: -item[1]['time'])[:app.config.confluence_profile_top]
+    lines = ['translator profile (%s):' % os.path.join(app.builder.outdir, REPORT)]
+    lines.append('%-28s %10s %10s %6s %12s' % ('node', 'calls', 'time, ms', '%', 'bytes'))
+    for name, entry in top:
+        lines.append('%-28s %10d %10.1f %6.1f %12d' % (
+            name, entry['calls'], entry['time'] * 1000, entry['time'] * 100 / total, entry['bytes']))
+    for name, count in sorted(report['unknown'].items()):
+        lines.append('no visitor for %s: %d nodes' % (name, count))
+    info(app, '\n'.join(lines))
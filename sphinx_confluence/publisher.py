@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+Confluence publisher
+
+Uploads the output of the ``confluence`` builder through the Confluence REST
+API::
+
+    python -m sphinx_confluence.publisher _build/confluence \\
+        --url https://confluence.example.com --space DOC --user bot
+
+The password is read from the ``CONFLUENCE_PASSWORD`` environment variable.
+
+Pages are uploaded level by level, so parents always exist before their
+children; the pages of one level are uploaded by a pool of worker threads,
+each keeping its own keep-alive connection. Requests answered with 429 or 5xx
+are retried with exponential backoff, honouring ``Retry-After``; before a
+page or attachment creation is retried, it is looked up, as the failed
+request may have created it.
+
+Only pages and attachments whose digests differ from those of the last
+successful publish (kept in ``.confluence-published.json`` in the output
+directory) are uploaded. Pages published before are looked up by the id kept
+there, so a page whose title changed is renamed rather than created anew.
+"""
+
+import argparse
+import base64
+import io
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from multiprocessing.pool import ThreadPool
+
+try:
+    from http.client import HTTPConnection, HTTPException, HTTPSConnection
+    from urllib.parse import quote, urlencode, urlsplit
+except ImportError:  # Python 2
+    from httplib import HTTPConnection, HTTPException, HTTPSConnection
+    from urllib import quote, urlencode
+    from urlparse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+PUBLISHED_STATE = '.confluence-published.json'
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class PublishError(Exception):
+
+    def __init__(self, message, retryable=False, retry_after=None, status=None):
+        Exception.__init__(self, message)
+        self.status = status
+        # failed on a connection error or a 429/5xx response, see ConfluenceClient.request
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class ConfluenceClient(object):
+    """
+    Minimal thread safe Confluence REST API client
+
+    Every thread reuses its own keep-alive connection.
+    """
+
+    def __init__(self, url, user=None, password=None, retries=5, backoff=0.5, max_backoff=30.0, timeout=60):
+        parts = urlsplit(url)
+        self.connection_class = HTTPSConnection if parts.scheme == 'https' else HTTPConnection
+        self.netloc = parts.netloc
+        self.base_path = parts.path.rstrip('/')
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.headers = {'Accept': 'application/json'}
+        if user:
+            credentials = ('%s:%s' % (user, password or '')).encode('utf-8')
+            self.headers['Authorization'] = 'Basic %s' % base64.b64encode(credentials).decode('ascii')
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self.connection_class(self.netloc, timeout=self.timeout)
+        return connection
+
+    def _reset_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+        self._local.connection = None
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        delay = min(self.backoff * (2 ** attempt), self.max_backoff)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def request(self, method, path, params=None, body=None, headers=None, retries=None):
+        """
+        Send request, retrying on 429/5xx and connection errors; return decoded JSON
+
+        :param retries: retries of the request, ``retries`` of the client by default
+        """
+        if retries is None:
+            retries = self.retries
+        # native string: httplib of Python 2 makes the request unicode otherwise,
+        # which cannot be joined with a binary body
+        url = str(self.base_path + path)
+        if params:
+            url += '?' + urlencode(sorted(
+                (name, value.encode('utf-8') if isinstance(value, type(u'')) else value)
+                for name, value in params.items()))
+
+        request_headers = dict(self.headers)
+        request_headers.update(headers or {})
+        if isinstance(body, dict):
+            body = json.dumps(body).encode('utf-8')
+            request_headers['Content-Type'] = 'application/json'
+
+        for attempt in range(retries + 1):
+            try:
+                connection = self._connection()
+                connection.request(method, url, body, request_headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (HTTPException, IOError) as e:
+                self._reset_connection()
+                if attempt == retries:
+                    raise PublishError('%s %s failed: %s' % (method, url, e), retryable=True)
+                time.sleep(self._delay(attempt))
+                continue
+
+            if response.status in RETRY_STATUSES and attempt < retries:
+                logger.debug('%s %s: %s, retrying', method, url, response.status)
+                time.sleep(self._delay(attempt, response.getheader('Retry-After')))
+                continue
+
+            if response.status >= 400:
+                raise PublishError('%s %s failed: %s %s' % (method, url, response.status, data[:200]),
+                                   retryable=response.status in RETRY_STATUSES,
+                                   retry_after=response.getheader('Retry-After'), status=response.status)
+            return json.loads(data.decode('utf-8')) if data else None
+
+    def create(self, path, body, lookup, headers=None):
+        """
+        POST creating content, which is not idempotent: the server may have
+        created it before the request failed, so before every retry the
+        content is looked up with lookup() and returned if it exists
+        """
+        for attempt in range(self.retries + 1):
+            if attempt:
+                existing = lookup()
+                if existing is not None:
+                    return existing
+            try:
+                return self.request('POST', path, body=body, headers=headers, retries=0)
+            except PublishError as e:
+                if not e.retryable or attempt == self.retries:
+                    raise
+                logger.debug('POST %s: %s, retrying', path, e)
+                time.sleep(self._delay(attempt, e.retry_after))
+
+    def find_page(self, space, title):
+        result = self.request('GET', '/rest/api/content', {
+            'spaceKey': space, 'title': title, 'expand': 'version,ancestors',
+        })
+        pages = result.get('results', [])
+        return pages[0] if pages else None
+
+    def get_page(self, page_id):
+        """
+        Page by id, None if it no longer exists
+        """
+        try:
+            return self.request('GET', '/rest/api/content/%s' % page_id, {'expand': 'version,ancestors'})
+        except PublishError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def save_page(self, space, title, body, parent_id=None, page=None):
+        data = {
+            'type': 'page',
+            'title': title,
+            'space': {'key': space},
+            'body': {'storage': {'value': body, 'representation': 'storage'}},
+        }
+        if parent_id is not None:
+            data['ancestors'] = [{'id': parent_id}]
+
+        if page is None:
+            return self.create('/rest/api/content', data, lambda: self.find_page(space, title))
+
+        data['version'] = {'number': page['version']['number'] + 1}
+        return self.request('PUT', '/rest/api/content/%s' % page['id'], body=data)
+
+    def save_attachment(self, page_id, filename, data):
+        path = '/rest/api/content/%s/child/attachment' % page_id
+
+        def find_attachment():
+            results = self.request('GET', path, {'filename': filename}).get('results', [])
+            return results[0] if results else None
+
+        existing = find_attachment()
+
+        boundary = uuid.uuid4().hex
+        body = b''.join([
+            ('--%s\r\n' % boundary).encode('ascii'),
+            ('Content-Disposition: form-data; name="file"; filename="%s"\r\n' % quote(filename)).encode('utf-8'),
+            b'Content-Type: application/octet-stream\r\n\r\n',
+            data,
+            ('\r\n--%s--\r\n' % boundary).encode('ascii'),
+        ])
+        headers = {
+            'Content-Type': 'multipart/form-data; boundary=%s' % boundary,
+            'X-Atlassian-Token': 'nocheck',
+        }
+        if existing is not None:
+            # new version of the attachment, uploading it twice only adds a version
+            return self.request('POST', '%s/%s/data' % (path, existing['id']), body=body, headers=headers)
+        return self.create(path, body, find_attachment, headers)
+
+
+class Publisher(object):
+    """
+    Publishes output directory of the confluence builder
+
+    :type client: ConfluenceClient
+    """
+
+    def __init__(self, client, space, outdir, workers=8, parent_id=None, publish_all=False):
+        self.client = client
+        self.space = space
+        self.outdir = outdir
+        self.workers = workers
+        self.parent_id = parent_id
+        self.publish_all = publish_all
+
+    def _read_json(self, filename, default=None):
+        try:
+            with open(os.path.join(self.outdir, filename)) as f:
+                return json.load(f)
+        except IOError:
+            return default
+
+    def load_pages(self):
+        """
+        Page metadata by docname, taken from the builder sidecar files
+        """
+        manifest = self._read_json('confluence-manifest.json')
+        if manifest is None:
+            raise PublishError('%s has no confluence-manifest.json, build it with "-b confluence"' % self.outdir)
+
+        pages = {}
+        for docname, entry in manifest['pages'].items():
+            metadata = self._read_json(docname + '.json', {})
+            metadata.update(entry)
+            pages[docname] = metadata
+        return pages
+
+    @staticmethod
+    def levels(pages):
+        """
+        Group docnames by depth in the page tree, parents first
+        """
+        def depth(docname, seen=()):
+            parent = pages[docname].get('parent')
+            if parent not in pages or parent in seen:
+                return 0
+            return depth(parent, seen + (docname,)) + 1
+
+        result = {}
+        for docname in pages:
+            result.setdefault(depth(docname), []).append(docname)
+        return [sorted(result[level]) for level in sorted(result)]
+
+    def publish_page(self, docname, page, parent_id, state):
+        """
+        Upload page body and attachments that changed
+
+        :return: page id and whether anything was uploaded
+        """
+        title = page['title'] or docname
+        page_id = state.get(docname, {}).get('id')
+        previous = {} if self.publish_all else state.get(docname, {})
+        if previous.get('id') and previous.get('title') == title and previous.get('parent') == parent_id and \
+                previous.get('body') == page['body'] and previous.get('attachments') == page['attachments']:
+            return previous['id'], False
+
+        # by id first: the title of the page may have changed since it was published
+        existing = self.client.get_page(page_id) if page_id else None
+        if existing is None:
+            existing = self.client.find_page(self.space, title)
+        if existing is None or existing['title'] != title or previous.get('body') != page['body'] or \
+                previous.get('parent') != parent_id:
+            with io.open(os.path.join(self.outdir, docname + '.xhtml'), encoding='utf-8') as f:
+                body = f.read()
+            existing = self.client.save_page(self.space, title, body, parent_id, existing)
+
+        uploaded = previous.get('attachments', {})
+        for filename, digest in sorted(page['attachments'].items()):
+            if uploaded.get(filename) != digest:
+                with open(os.path.join(self.outdir, '_attachments', filename), 'rb') as f:
+                    self.client.save_attachment(existing['id'], filename, f.read())
+
+        return existing['id'], True
+
+    def publish(self):
+        """
+        Publish pages, return number of uploaded pages
+        """
+        pages = self.load_pages()
+        state = self._read_json(PUBLISHED_STATE, {})
+        page_ids = {}
+        published = 0
+
+        def publish_page(docname):
+            page = pages[docname]
+            parent_id = page_ids.get(page.get('parent'), self.parent_id)
+            return (docname, parent_id) + self.publish_page(docname, page, parent_id, state)
+
+        pool = ThreadPool(self.workers)
+        try:
+            for level in self.levels(pages):
+                for docname, parent_id, page_id, uploaded in pool.map(publish_page, level):
+                    page_ids[docname] = page_id
+                    published += uploaded
+                    state[docname] = {
+                        'id': page_id,
+                        'title': pages[docname]['title'] or docname,
+                        'parent': parent_id,
+                        'body': pages[docname]['body'],
+                        'attachments': pages[docname]['attachments'],
+                    }
+        finally:
+            pool.close()
+            pool.join()
+            with open(os.path.join(self.outdir, PUBLISHED_STATE), 'w') as f:
+                json.dump(state, f, indent=2, sort_keys=True)
+
+        return published
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Publish output of the sphinx confluence builder')
+    parser.add_argument('outdir', help='output directory of "sphinx-build -b confluence"')
+    parser.add_argument('--url', required=True, help='Confluence base URL')
+    parser.add_argument('--space', required=True, help='space key')
+    parser.add_argument('--user', help='user name; password is taken from CONFLUENCE_PASSWORD')
+    parser.add_argument('--parent-id', help='id of the page to publish under')
+    parser.add_argument('--workers', type=int, default=8, help='number of concurrent uploads (default: 8)')
+    parser.add_argument('--retries', type=int, default=5, help='retries on 429/5xx responses (default: 5)')
+    parser.add_argument('--all', action='store_true', help='upload every page, even unchanged ones')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    client = ConfluenceClient(args.url, args.user, os.environ.get('CONFLUENCE_PASSWORD'), retries=args.retries)
+    publisher = Publisher(client, args.space, args.outdir, args.workers, args.parent_id, args.all)
+
+    start = time.time()
+    published = publisher.publish()
+    logger.info('%d pages published in %.1fs', published, time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Resolution of internal references into Confluence pages and anchors
+
+References to other documents are resolved by lookups in the anchor index
+collected while documents are read (see sphinx_confluence.split), without
+looking into the doctrees of their targets.
+"""
+
+import posixpath
+
+from sphinx_confluence.registry import get_page_anchors
+
+
+def resolve_anchor(env, docname, refid, split_pages=True):
+    """
+    Page holding the id of the document and the anchor to link to on it
+
+    :param split_pages: whether the builder writes pages split off documents,
+        otherwise ids always live on the document page
+    :return: (page, anchor), anchor is None for the top of the page
+    """
+    page, anchor = get_page_anchors(env).get(docname, {}).get(refid, (docname, refid))
+    if not split_pages:
+        return docname, refid
+    return page, anchor
+
+
+def get_uri_docnames(builder):
+    """
+    Maps normalized target URIs of the builder to docnames
+
+    Made once per build and cached on the builder, see clear_uri_docnames.
+    """
+    uri_docnames = getattr(builder, 'confluence_uri_docnames', None)
+    if uri_docnames is None:
+        uri_docnames = dict(
+            (posixpath.normpath(builder.get_target_uri(docname)), docname) for docname in builder.env.found_docs)
+        builder.confluence_uri_docnames = uri_docnames
+    return uri_docnames
+
+
+def clear_uri_docnames(app, env):
+    """
+    Drop the URI map of the previous build, documents may have been added or removed
+    """
+    app.builder.confluence_uri_docnames = None
+
+
+def resolve_uri(builder, fromdocname, refuri, split_pages=True):
+    """
+    Page and anchor the internal URI of a reference points to
+
+    :return: (page, anchor) or None if the URI does not point to a document
+    """
+    path, _, fragment = refuri.partition('#')
+    if path:
+        base = posixpath.dirname(builder.get_target_uri(fromdocname))
+        docname = get_uri_docnames(builder).get(posixpath.normpath(posixpath.join(base, path)))
+        if docname is None:
+            return None
+    else:
+        docname = fromdocname
+
+    if not fragment:
+        return docname, None
+    return resolve_anchor(builder.env, docname, fragment, split_pages)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Data collected during the read phase and kept in the build environment
+"""
+
+#: Per-document registries kept in the build environment, see get_env_registry
+ENV_REGISTRIES = ('titles', 'attachments', 'splits', 'anchors', 'image_widths', 'references', 'toctrees',
+                  'includes')
+
+
+def get_env_registry(env, name):
+    """
+    Per-document registry stored in the build environment
+
+    Registries map docname to data collected during the read phase. They are
+    pickled with the environment for incremental builds, purged with their
+    documents and merged back from parallel readers.
+
+    :type env: sphinx.environment.BuildEnvironment
+    :type name: str
+    :rtype: dict
+    """
+    attr = 'confluence_%s' % name
+    if not hasattr(env, attr):
+        setattr(env, attr, {})
+    return getattr(env, attr)
+
+
+def get_page_titles(env):
+    """ Maps docname to the plain text title of its Confluence page """
+    return get_env_registry(env, 'titles')
+
+
+def get_page_attachments(env):
+    """ Maps docname to the sorted source paths (relative to srcdir) of its attachments """
+    return get_env_registry(env, 'attachments')
+
+
+def get_page_anchors(env):
+    """
+    Maps docname to the index of its anchors: id -> [page, anchor]
+
+    Page is the document or the page split off it holding the id, anchor is
+    null for ids of a split-off section itself, see sphinx_confluence.split.
+    """
+    return get_env_registry(env, 'anchors')
+
+
+def get_attachment_index(env):
+    """
+    Maps attachment source path (relative to srcdir) to its index entry:
+    sha256, filename, page (docname it is attached to), source, stat
+
+    Unlike the per-document registries it is rebuilt as a whole once all
+    documents are read, see sphinx_confluence.attachments.
+    """
+    if not hasattr(env, 'confluence_attachment_index'):
+        env.confluence_attachment_index = {}
+    return env.confluence_attachment_index
+
+
+def purge_env_registries(app, env, docname):
+    for name in ENV_REGISTRIES:
+        get_env_registry(env, name).pop(docname, None)
+
+
+def merge_env_registries(app, env, docnames, other):
+    for name in ENV_REGISTRIES:
+        registry = get_env_registry(other, name)
+        get_env_registry(env, name).update(
+            (docname, registry[docname]) for docname in docnames if docname in registry)
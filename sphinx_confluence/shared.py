@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Shared pages for content included into several documents
+
+With ``confluence_shared_includes = True`` runs of sibling nodes coming from
+the same included file (``.. include::``) are wrapped in shared_include
+nodes when a document is read, and fingerprinted by their content. Once all
+documents are read, fragments found in two or more documents are indexed::
+
+    {"<fingerprint>": {"owner": "<docname>", "docs": ["<docname>", ...], "source": "<included file>",
+                       "page": "<owner>--shared-<fingerprint prefix>", "title": "<page title>"}}
+
+The confluence builder translates each of them once, into a page of its own
+written with the owner (the first of the documents by name) as its parent,
+and every document including it, the owner too, shows it with the Confluence
+Include Page macro. Other builders render the content in place.
+"""
+
+import copy
+import hashlib
+import os
+
+from docutils import nodes
+
+from sphinx_confluence.registry import get_env_registry
+from sphinx_confluence.util import TRANSLATED_BUILDERS
+
+#: Fragments with less text are kept inline, the include macro would not be smaller
+MIN_SIZE = 128
+
+# attributes that depend on the including document
+_DOCUMENT_ATTRIBUTES = ('ids', 'names', 'dupnames', 'backrefs')
+
+
+class shared_include(nodes.Element):
+    """ Content of an included file, see module docstring """
+
+
+def get_page_includes(env):
+    """ Maps docname to the fragments it includes: [[fingerprint, source]] """
+    return get_env_registry(env, 'includes')
+
+
+def get_shared_index(env):
+    """ Fragments shared by several documents, see module docstring """
+    if not hasattr(env, 'confluence_shared_index'):
+        env.confluence_shared_index = {}
+    return env.confluence_shared_index
+
+
+def get_shared_pages(env, docname):
+    """
+    Shared pages owned by the document: list of (page, title)
+    """
+    return sorted((shared['page'], shared['title'])
+                  for shared in get_shared_index(env).values() if shared['owner'] == docname)
+
+
+def node_source(node):
+    """
+    Source file of the node, or of its first descendant knowing it
+    """
+    for child in node.traverse(nodes.Element):
+        if child.source:
+            return child.source
+    return None
+
+
+def fingerprint(run):
+    """
+    Digest of the nodes, regardless of the ids given to them by the including document
+    """
+    digest = hashlib.sha256()
+    for node in run:
+        node = copy.deepcopy(node)
+        for element in node.traverse(nodes.Element):
+            for name in _DOCUMENT_ATTRIBUTES:
+                element[name] = []
+        digest.update(node.pformat().encode('utf-8'))
+    return digest.hexdigest()
+
+
+def wrap_included(parent, document_source):
+    """
+    Wrap runs of children coming from the same included file, return the wrappers
+    """
+    wrappers = []
+    run = []
+    run_source = None
+
+    def flush():
+        if run and sum(len(node.astext()) for node in run) >= MIN_SIZE:
+            wrapper = shared_include(source=run_source)
+            parent.insert(parent.index(run[0]), wrapper)
+            for node in run:
+                parent.remove(node)
+                wrapper.append(node)
+            wrappers.append(wrapper)
+        del run[:]
+
+    for child in list(parent.children):
+        source = None
+        if isinstance(child, nodes.Element) and not isinstance(child, (nodes.section, nodes.title)):
+            # sections stay in place, Sphinx collects the table of contents from them
+            source = node_source(child)
+        if source is not None and source != document_source:
+            if source != run_source:
+                flush()
+            run.append(child)
+            run_source = source
+            continue
+
+        flush()
+        run_source = None
+        if isinstance(child, nodes.Element):
+            wrappers.extend(wrap_included(child, document_source))
+    flush()
+    return wrappers
+
+
+def process_shared_includes(app, doctree):
+    """
+    Wrap and fingerprint included content of the document
+    """
+    env = app.builder.env
+    if not app.config.confluence_shared_includes:
+        get_page_includes(env).pop(env.docname, None)
+        return
+
+    includes = []
+    for wrapper in wrap_included(doctree, env.doc2path(env.docname)):
+        wrapper['fingerprint'] = fingerprint(wrapper.children)
+        wrapper['source'] = os.path.relpath(wrapper['source'], env.srcdir).replace(os.sep, '/')
+        includes.append([wrapper['fingerprint'], wrapper['source']])
+    get_page_includes(env)[env.docname] = includes
+
+
+def update_shared_index(app, env):
+    """
+    Index fragments shared by several documents once all documents are read
+
+    Returns documents whose shared fragments changed, so they are written again.
+
+    :type app: sphinx.application.Sphinx
+    :type env: sphinx.environment.BuildEnvironment
+    """
+    # imported here, sphinx_confluence.split imports this module
+    from sphinx_confluence.split import PAGE_SEPARATOR
+
+    occurrences = {}
+    for docname, includes in get_page_includes(env).items():
+        for digest, source in includes:
+            docs = occurrences.setdefault(digest, (source, set()))[1]
+            docs.add(docname)
+
+    index = {}
+    for digest, (source, docs) in occurrences.items():
+        if len(docs) < 2:
+            continue
+        docs = sorted(docs)
+        index[digest] = {
+            'owner': docs[0],
+            'docs': docs,
+            'source': source,
+            'page': '%s%sshared-%s' % (docs[0], PAGE_SEPARATOR, digest[:12]),
+            'title': '%s (%s)' % (source, digest[:8]),
+        }
+
+    previous = get_shared_index(env)
+    env.confluence_shared_index = index
+
+    affected = set()
+    for digest in set(previous) | set(index):
+        if previous.get(digest) != index.get(digest):
+            for shared in (previous.get(digest), index.get(digest)):
+                if shared is not None:
+                    affected.update(docname for docname in shared['docs'] if docname in env.all_docs)
+    return sorted(affected)
+
+
+def resolve_shared_includes(app, doctree, docname):
+    """
+    Unwrap included content for builders that do not render shared_include nodes
+    """
+    if app.builder.name in TRANSLATED_BUILDERS:
+        return
+    for node in doctree.traverse(shared_include):
+        node.replace_self(node.children)
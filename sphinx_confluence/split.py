@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Splitting of large documents into child pages
+
+With ``confluence_split_level`` set, every document whose content exceeds
+``confluence_split_budget`` bytes or ``confluence_split_macro_budget`` macros
+gets its sections of that level (the document title is level 1) published as
+child pages of the document page. The plan is made in a single pass over the
+doctree when the document is read and kept in the environment::
+
+    {
+      "pages": [{"page": "<docname>--<section id>", "id": "<section id>", "title": "<document title> - <section title>"}]
+    }
+
+The same pass indexes the ids of every document (see
+sphinx_confluence.registry.get_page_anchors): each id maps to the page holding
+it and to the anchor to link to, null for ids of a split-off section itself
+(links go to the top of the child page).
+
+Sizes are estimated from the doctree: bytes of the text, raw content and
+literal blocks, and the number of nodes rendered as macros.
+"""
+
+from docutils import nodes
+
+from sphinx_confluence.jira import jira_issue, jira_issues
+from sphinx_confluence.registry import get_env_registry, get_page_anchors, get_page_titles
+from sphinx_confluence.shared import get_shared_pages
+
+#: Separates docname and section id in the names of split-off pages
+PAGE_SEPARATOR = '--'
+
+# nodes the translator renders as Confluence macros
+MACRO_NODES = (nodes.literal_block, nodes.Admonition, nodes.image, nodes.target, jira_issue, jira_issues)
+
+
+def get_page_splits(env):
+    """ Maps docname to its split plan, only for documents that are split """
+    return get_env_registry(env, 'splits')
+
+
+def plan_split(doctree, docname, level=None, byte_budget=None, macro_budget=None):
+    """
+    Split plan of the document (None if it is not split) and its anchor index
+
+    :type doctree: docutils.nodes.document
+    """
+    pages = []
+    anchors = {}
+    document_titles = []
+    counts = {'bytes': 0, 'macros': 0}
+
+    def walk(node, depth, page):
+        if isinstance(node, nodes.Text):
+            counts['bytes'] += len(node.encode('utf-8'))
+            return
+        if isinstance(node, (nodes.raw, nodes.literal_block)):
+            counts['bytes'] += len(node.rawsource.encode('utf-8'))
+            counts['macros'] += node.rawsource.count('<ac:structured-macro') if isinstance(node, nodes.raw) else 1
+        elif isinstance(node, MACRO_NODES):
+            counts['macros'] += 1
+
+        anchor_ids = node['ids'] if isinstance(node, nodes.Element) else ()
+        if isinstance(node, nodes.section):
+            depth += 1
+            title = node[0].astext() if len(node) and isinstance(node[0], nodes.title) else None
+            if depth == 1:
+                document_titles.append(title)
+            if depth == level and node['ids']:
+                page = '%s%s%s' % (docname, PAGE_SEPARATOR, node['ids'][0])
+                pages.append({'page': page, 'id': node['ids'][0], 'title': title or node['ids'][0]})
+                for anchor in node['ids']:
+                    anchors[anchor] = [page, None]
+                anchor_ids = ()
+
+        for anchor in anchor_ids:
+            anchors[anchor] = [page, anchor]
+
+        if not isinstance(node, (nodes.raw, nodes.literal_block)):
+            for child in node.children:
+                walk(child, depth, page)
+
+    walk(doctree, 0, docname)
+
+    exceeded = (byte_budget is not None and counts['bytes'] > byte_budget) or \
+        (macro_budget is not None and counts['macros'] > macro_budget)
+    if not pages or not exceeded:
+        return None, dict((anchor, [docname, anchor]) for anchor in anchors)
+
+    # page titles are unique in a Confluence space: section titles are prefixed
+    # with the document title, so pages split off different documents never
+    # clash, and with the section id when repeated within the document
+    titles = [page['title'] for page in pages]
+    for page in pages:
+        title = '%s - %s' % (document_titles[0] if document_titles else docname, page['title'])
+        if titles.count(page['title']) > 1:
+            title = '%s (%s)' % (title, page['id'])
+        page['title'] = title
+    return {'pages': pages}, anchors
+
+
+def process_page_split(app, doctree):
+    """
+    Plan splitting of the document into child pages and index its anchors,
+    see module docstring
+    """
+    env = app.builder.env
+    config = app.config
+
+    # values given with -D are strings
+    level, byte_budget, macro_budget = [
+        None if value is None else int(value)
+        for value in (config.confluence_split_level, config.confluence_split_budget,
+                      config.confluence_split_macro_budget)
+    ]
+    plan, anchors = plan_split(doctree, env.docname, level or None, byte_budget, macro_budget)
+    get_page_anchors(env)[env.docname] = anchors
+    if plan is not None:
+        get_page_splits(env)[env.docname] = plan
+
+
+def get_split_pages(env, docname):
+    """
+    Pages split off the document: list of (page, title)
+
+    Shared pages the document owns (see sphinx_confluence.shared) follow its
+    sections.
+    """
+    plan = get_page_splits(env).get(docname)
+    pages = [(page['page'], page['title']) for page in plan['pages']] if plan is not None else []
+    return pages + get_shared_pages(env, docname)
+
+
+def get_page_title(env, page):
+    """
+    Title of the document or split-off page
+    """
+    titles = get_page_titles(env)
+    if page in titles:
+        return titles[page]
+
+    docname = page.rsplit(PAGE_SEPARATOR, 1)[0]
+    for name, title in get_split_pages(env, docname):
+        if name == page:
+            return title
+    return None
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Local stub of the Confluence REST API
+
+Implements just enough of ``/rest/api/content`` for the publisher, keeping
+pages and attachments in memory, so publishing can be tried and measured
+offline::
+
+    python -m sphinx_confluence.stubserver --port 8090 --fail-every 10 --latency 0.02
+    python -m sphinx_confluence.publisher _build/confluence --url http://localhost:8090 --space DOC
+
+``--fail-every N`` answers every N-th request with 503 (or 429 with
+``--fail-status 429``) to exercise retries; with ``--fail-after-commit`` the
+failing requests are carried out before the failure is answered, like a
+server timing out after saving. ``--latency`` delays every response. Request, failure and connection counters are printed on exit.
+"""
+
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, unquote, urlsplit
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qs, urlsplit
+
+_CONTENT_RE = re.compile(r'^/rest/api/content/(?P<id>\d+)$')
+_FILENAME_RE = re.compile(r'filename="([^"]*)"')
+_ATTACHMENTS_RE = re.compile(r'^/rest/api/content/(?P<id>\d+)/child/attachment(?:/(?P<attachment>\d+)/data)?$')
+
+
+def parse_multipart_file(body):
+    """
+    Filename and content of the single file part of a multipart/form-data body
+    """
+    boundary = body[:body.index(b'\r\n')]
+    headers, _, rest = body[len(boundary) + 2:].partition(b'\r\n\r\n')
+    data = rest[:rest.rindex(b'\r\n' + boundary)]
+    match = _FILENAME_RE.search(headers.decode('utf-8'))
+    return unquote(match.group(1)) if match else None, data
+
+
+class StubConfluence(object):
+    """
+    In-memory Confluence content store
+    """
+
+    def __init__(self, fail_every=0, fail_status=503, latency=0.0, fail_after_commit=False):
+        self.fail_every = fail_every
+        self.fail_status = fail_status
+        self.fail_after_commit = fail_after_commit
+        self.latency = latency
+        self.pages = {}
+        self.attachments = {}
+        self.stats = {'requests': 0, 'failures': 0, 'connections': 0}
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def next_id(self):
+        return str(next(self._ids))
+
+    def should_fail(self):
+        with self.lock:
+            self.stats['requests'] += 1
+            if self.fail_every and self.stats['requests'] % self.fail_every == 0:
+                self.stats['failures'] += 1
+                return True
+        return False
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # the response of the current request is replaced with a failure, see send_json
+    failing = False
+    # headers and body are written separately
+    disable_nagle_algorithm = True
+
+    @property
+    def store(self):
+        """ :rtype: StubConfluence """
+        return self.server.store
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.store.lock:
+            self.store.stats['connections'] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_failure(self):
+        self.send_json(self.store.fail_status, {'message': 'stub failure'}, {'Retry-After': '0'})
+
+    def send_json(self, status, data=None, headers=None):
+        if self.failing:
+            # the request is carried out, its response is lost, see --fail-after-commit
+            self.failing = False
+            return self.send_failure()
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def handle_request(self, method):
+        body = self.read_body()
+        if self.store.latency:
+            time.sleep(self.store.latency)
+        self.failing = self.store.should_fail()
+        if self.failing and not self.store.fail_after_commit:
+            self.failing = False
+            return self.send_failure()
+
+        url = urlsplit(self.path)
+        query = dict((name, values[0]) for name, values in parse_qs(url.query).items())
+
+        with self.store.lock:
+            if url.path == '/rest/api/content':
+                if method == 'GET':
+                    return self.find_pages(query)
+                if method == 'POST':
+                    return self.save_page(None, json.loads(body.decode('utf-8')))
+
+            match = _CONTENT_RE.match(url.path)
+            if match and method == 'GET' and match.group('id') in self.store.pages:
+                return self.send_json(200, self.store.pages[match.group('id')])
+            if match and method == 'PUT':
+                return self.save_page(match.group('id'), json.loads(body.decode('utf-8')))
+
+            match = _ATTACHMENTS_RE.match(url.path)
+            if match and match.group('id') in self.store.pages:
+                if method == 'GET':
+                    return self.find_attachments(match.group('id'), query)
+                if method == 'POST':
+                    return self.save_attachment(match.group('id'), match.group('attachment'), body)
+
+        self.send_json(404, {'message': 'not found'})
+
+    def find_pages(self, query):
+        results = [
+            page for page in self.store.pages.values()
+            if page['space']['key'] == query.get('spaceKey') and page['title'] == query.get('title')
+        ]
+        self.send_json(200, {'results': results, 'size': len(results)})
+
+    def save_page(self, page_id, data):
+        if page_id is None:
+            page_id = self.store.next_id()
+            version = 1
+        elif page_id not in self.store.pages:
+            return self.send_json(404, {'message': 'page %s not found' % page_id})
+        else:
+            version = self.store.pages[page_id]['version']['number'] + 1
+            if data.get('version', {}).get('number') != version:
+                return self.send_json(409, {'message': 'version conflict'})
+
+        page = dict(data, id=page_id, version={'number': version})
+        self.store.pages[page_id] = page
+        self.send_json(200, page)
+
+    def find_attachments(self, page_id, query):
+        results = [
+            attachment for attachment in self.store.attachments.values()
+            if attachment['page'] == page_id and attachment['title'] == query.get('filename')
+        ]
+        self.send_json(200, {'results': results, 'size': len(results)})
+
+    def save_attachment(self, page_id, attachment_id, body):
+        filename, data = parse_multipart_file(body)
+        attachment_id = attachment_id or self.store.next_id()
+        self.store.attachments[attachment_id] = {
+            'id': attachment_id, 'page': page_id, 'title': filename, 'size': len(data),
+        }
+        self.send_json(200, {'results': [self.store.attachments[attachment_id]]})
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, store):
+        HTTPServer.__init__(self, address, StubRequestHandler)
+        self.store = store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local stub of the Confluence REST API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--fail-every', type=int, default=0, help='fail every N-th request')
+    parser.add_argument('--fail-status', type=int, default=503, help='status of failed requests (default: 503)')
+    parser.add_argument('--fail-after-commit', action='store_true',
+                        help='carry out failing requests before answering the failure')
+    parser.add_argument('--latency', type=float, default=0.0, help='delay of every response, seconds')
+    args = parser.parse_args(argv)
+
+    store = StubConfluence(args.fail_every, args.fail_status, args.latency, args.fail_after_commit)
+    server = StubServer((args.host, args.port), store)
+    print('Stub Confluence listening on http://%s:%s' % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print('pages: %d, attachments: %d, requests: %d, failures: %d, connections: %d' % (
+            len(store.pages), len(store.attachments), store.stats['requests'], store.stats['failures'],
+            store.stats['connections']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Several Confluence outputs from one read of the sources
+
+``confluence_targets`` maps target names to settings overriding ``conf.py``
+for that target::
+
+    confluence_targets = {
+        'public': {'confluence_jira_server_id': '146780e9-...', 'confluence_jira_baseurl': 'https://jira.example.com'},
+        'internal': {'confluence_admonition_map': {'note': 'note'}, 'confluence_code_languages': ['python', 'none']},
+    }
+
+The confluence builder reads the documents once, then writes every target
+into ``<outdir>/<target>`` in a process of its own, forked after the read, so
+targets share the parsed doctrees and are written in parallel. Each target
+directory is a complete output: pages, attachments, manifest and bundle.
+
+Only settings applied while pages are written may differ between targets:
+overriding one that changes the doctrees (``'env'``) is an error.
+"""
+
+import os
+import sys
+import traceback
+
+from sphinx.errors import ConfigError, SphinxError
+
+from sphinx_confluence.util import info
+
+
+def get_targets(config):
+    """
+    Sorted list of (target name, overrides), empty without ``confluence_targets``
+
+    :type config: sphinx.config.Config
+    """
+    targets = config.confluence_targets or {}
+    for name, overrides in targets.items():
+        if not name or os.path.basename(name) != name:
+            raise ConfigError('confluence_targets: %r is not a valid target directory name' % name)
+        for setting in overrides:
+            if setting not in config.values:
+                raise ConfigError('confluence_targets: unknown setting %r of target %r' % (setting, name))
+            if config.values[setting][1] == 'env':
+                raise ConfigError('confluence_targets: %r of target %r changes the doctrees, '
+                                  'it cannot differ between targets' % (setting, name))
+    return sorted(targets.items())
+
+
+def apply_overrides(config, overrides):
+    for setting, value in overrides.items():
+        setattr(config, setting, value)
+
+
+def fork_available():
+    try:
+        import multiprocessing
+    except ImportError:
+        return False
+    return os.name == 'posix' and hasattr(multiprocessing, 'Process')
+
+
+def _run_target(write, name):
+    try:
+        write(name)
+    except BaseException:
+        traceback.print_exc()
+        sys.stderr.flush()
+        os._exit(1)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # skip exit handlers inherited from the parent build
+    os._exit(0)
+
+
+def write_targets(app, targets, write):
+    """
+    Call write(target name) for every target, in forked processes where available
+
+    :type app: sphinx.application.Sphinx
+    """
+    names = [name for name, _ in targets]
+    if len(names) < 2 or not fork_available():
+        for name in names:
+            write(name)
+        return
+
+    import multiprocessing
+    context = multiprocessing.get_context('fork') if hasattr(multiprocessing, 'get_context') else multiprocessing
+    processes = []
+    for name in names:
+        process = context.Process(target=_run_target, args=(write, name))
+        process.start()
+        processes.append((name, process))
+
+    failed = []
+    for name, process in processes:
+        process.join()
+        if process.exitcode != 0:
+            failed.append(name)
+    if failed:
+        raise SphinxError('writing confluence targets failed: %s' % ', '.join(failed))
+    info(app, 'wrote confluence targets: %s' % ', '.join(names))
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the extension modules
+"""
+
+import sphinx
+
+#: (major, minor, micro) of the running Sphinx, for version gates
+SPHINX_VERSION = tuple(sphinx.version_info[:3])
+
+#: Builders rendering documents with HTMLConfluenceTranslator
+TRANSLATED_BUILDERS = ('html', 'json', 'confluence', 'json_conf')
+
+try:
+    from sphinx.util import logging
+    logger = logging.getLogger('sphinx_confluence')
+except (ImportError, AttributeError):  # Sphinx < 1.6
+    logger = None
+
+
+def info(app, message):
+    """
+    :type app: sphinx.application.Sphinx
+    """
+    if logger is not None:
+        logger.info(message)
+    else:
+        app.info(message)
+
+
+def warning(app, message):
+    """
+    :type app: sphinx.application.Sphinx
+    """
+    if logger is not None:
+        logger.warning(message)
+    else:
+        app.warn(message)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Well-formedness check of the pages written by the confluence builder
+
+With ``confluence_validate = True`` every page body is parsed with expat as
+soon as it is written, so malformed storage format is reported by the build
+with its page, line and column instead of being rejected by Confluence on
+upload. The body is wrapped in a root element declaring the ``ac``, ``ri`` and
+``at`` namespaces; named entities must be HTML ones.
+
+Serial builds parse pages in a pool of processes while the next pages are
+translated. With ``-j N`` pages are parsed right away in the processes writing
+them. ``confluence_validate_fail_fast = True`` stops the build on the first
+malformed page.
+"""
+
+import os
+import xml.parsers.expat
+
+try:
+    from html.entities import name2codepoint
+except ImportError:  # Python 2
+    from htmlentitydefs import name2codepoint
+
+from sphinx.errors import SphinxError
+
+from sphinx_confluence.util import warning
+
+ROOT_START = (
+    b'<ac:confluence xmlns:ac="http://atlassian.com/content" '
+    b'xmlns:ri="http://atlassian.com/resource/identifier" xmlns:at="http://atlassian.com/template">'
+)
+ROOT_END = b'</ac:confluence>'
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StorageFormatError(SphinxError):
+    category = 'Malformed Confluence storage format'
+
+
+def check_page(filename):
+    """
+    Parse the page body, return the first error as (line, column, message) or None
+    """
+    parser = xml.parsers.expat.ParserCreate(namespace_separator=' ')
+    # unknown entities are reported to SkippedEntityHandler instead of failing the parse
+    parser.UseForeignDTD(True)
+    unknown = []
+
+    def skipped_entity(name, is_parameter_entity):
+        if name not in name2codepoint and not unknown:
+            unknown.append((parser.CurrentLineNumber, parser.CurrentColumnNumber, 'undefined entity &%s;' % name))
+
+    parser.SkippedEntityHandler = skipped_entity
+
+    try:
+        parser.Parse(ROOT_START, False)
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                parser.Parse(chunk, False)
+                if unknown:
+                    break
+        parser.Parse(ROOT_END, True)
+    except xml.parsers.expat.ExpatError as e:
+        error = (e.lineno, e.offset, xml.parsers.expat.ErrorString(e.code))
+        unknown.append(error)
+
+    if not unknown:
+        return None
+    line, column, message = unknown[0]
+    if line == 1:
+        # the root element is on the first line of the body
+        column = max(column - len(ROOT_START), 0)
+    return line, column + 1, message
+
+
+def check_page_job(job):
+    pagename, filename = job
+    return pagename, filename, check_page(filename)
+
+
+class PageValidator(object):
+    """
+    Checks pages as the builder writes them, see module docstring
+
+    :type app: sphinx.application.Sphinx
+    """
+
+    def __init__(self, app, fail_fast=False):
+        self.app = app
+        self.fail_fast = fail_fast
+        self.pid = os.getpid()
+        self.pool = None
+        self.pending = []
+
+    def submit(self, pagename, filename):
+        if os.getpid() != self.pid:
+            # process writing pages in parallel, check in place
+            self.report(pagename, filename, check_page(filename))
+            return
+
+        if self.pool is None:
+            from multiprocessing import Pool
+            self.pool = Pool()
+        self.pending.append(self.pool.apply_async(check_page_job, ((pagename, filename),)))
+        if self.fail_fast:
+            self.collect(wait=False)
+
+    def collect(self, wait=True):
+        pending = []
+        for result in self.pending:
+            if wait or result.ready():
+                self.report(*result.get())
+            else:
+                pending.append(result)
+        self.pending = pending
+
+    def report(self, pagename, filename, error):
+        if error is None:
+            return
+
+        line, column, message = error
+        message = '%s (%s), line %d, column %d: %s' % (
+            pagename, os.path.relpath(filename, self.app.outdir), line, column, message)
+        if self.fail_fast:
+            self.close(terminate=True)
+            raise StorageFormatError(message)
+        warning(self.app, 'malformed storage format: %s' % message)
+
+    def close(self, terminate=False):
+        if self.pool is not None:
+            if terminate:
+                self.pool.terminate()
+            else:
+                self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def finish(self):
+        """
+        Wait for the pages being checked
+        """
+        try:
+            self.collect()
+        finally:
+            self.close()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Rebuild Confluence pages as their sources change and preview them locally
+
+Usage::
+
+    sphinx-confluence-watch docs [docs/_build/confluence-preview] [--port 8000] [-D name=value ...]
+
+The Sphinx application is created once and kept between builds, so a build
+after an edit only reads the changed documents and writes them, the
+documents including them and the documents referring to their labels (see
+sphinx_confluence.dependencies). Sources are polled every ``--interval``
+seconds; a change of ``conf.py`` starts a new application. Written pages are
+served by sphinx_confluence.preview and reload themselves after every build.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from sphinx.application import Sphinx
+
+from sphinx_confluence.preview import serve
+
+
+def scan(srcdir, skip):
+    """
+    Modification times of the files under srcdir, outside of the skipped directories
+    """
+    mtimes = {}
+    for dirpath, dirnames, filenames in os.walk(srcdir):
+        dirnames[:] = [name for name in dirnames
+                       if not name.startswith('.') and os.path.join(dirpath, name) not in skip]
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                pass
+    return mtimes
+
+
+class Watcher(object):
+
+    def __init__(self, srcdir, outdir, overrides=None, status=None):
+        self.srcdir = os.path.abspath(srcdir)
+        self.outdir = os.path.abspath(outdir)
+        self.doctreedir = os.path.join(self.outdir, '.doctrees')
+        self.confdir = self.srcdir
+        self.overrides = overrides or {}
+        self.status = status
+        self.app = None
+        self.written = []
+
+    def create_app(self):
+        self.app = Sphinx(self.srcdir, self.confdir, self.outdir, self.doctreedir, 'confluence',
+                          self.overrides, status=self.status, warning=sys.stderr)
+        self.app.connect('doctree-resolved', lambda app, doctree, docname: self.written.append(docname))
+
+    def build(self, new_app=False):
+        """
+        Build the pages, return the written docnames
+        """
+        if new_app or self.app is None:
+            self.create_app()
+        self.written = []
+        self.app.build()
+        return self.written
+
+    def run(self, interval=0.2, on_build=None):
+        skip = set([self.outdir, self.doctreedir])
+        mtimes = scan(self.srcdir, skip)
+        self.report(self.timed_build(), on_build)
+        while True:
+            time.sleep(interval)
+            current = scan(self.srcdir, skip)
+            if current == mtimes:
+                continue
+            changed = set(path for path in set(current) | set(mtimes) if current.get(path) != mtimes.get(path))
+            mtimes = current
+            self.report(self.timed_build(os.path.join(self.confdir, 'conf.py') in changed), on_build)
+
+    def timed_build(self, new_app=False):
+        start = time.time()
+        try:
+            written = self.build(new_app)
+        except Exception as e:
+            # a broken source must not stop watching
+            sys.stderr.write('build failed: %s: %s\n' % (type(e).__name__, e))
+            self.app = None
+            return None
+        return written, time.time() - start
+
+    def report(self, result, on_build):
+        if result is None:
+            return
+        written, elapsed = result
+        print('built in %.2f s, %d pages written%s' % (
+            elapsed, len(written), ': ' + ', '.join(written[:10]) if written else ''))
+        if on_build is not None:
+            on_build()
+
+
+def parse_overrides(values):
+    overrides = {}
+    for value in values:
+        name, _, setting = value.partition('=')
+        overrides[name] = setting
+    return overrides
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuild Confluence pages as their sources change')
+    parser.add_argument('sourcedir')
+    parser.add_argument('outputdir', nargs='?', help='default: <sourcedir>/_build/confluence-preview')
+    parser.add_argument('-D', dest='define', action='append', default=[], metavar='name=value',
+                        help='override a setting of conf.py')
+    parser.add_argument('--interval', type=float, default=0.2, help='seconds between source scans (default: 0.2)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000, help='preview port, 0 to disable (default: 8000)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show Sphinx build output')
+    args = parser.parse_args(argv)
+
+    outdir = args.outputdir or os.path.join(args.sourcedir, '_build', 'confluence-preview')
+    watcher = Watcher(args.sourcedir, outdir, parse_overrides(args.define), sys.stdout if args.verbose else None)
+
+    server = None
+    if args.port:
+        server = serve(watcher.outdir, args.host, args.port)
+        print('Preview on http://%s:%s' % server.server_address)
+    try:
+        watcher.run(args.interval, server.notify_build if server is not None else None)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()